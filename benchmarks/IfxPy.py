@@ -0,0 +1,231 @@
+"""
+Stand-in for the IfxPy module that answers sysmaster queries with synthetic rows.
+
+Benchmarks put this directory in front of sys.path so the collector imports this
+module instead of the real driver. The columns of a result are taken from the
+select list of the statement, the number of rows from the largest table in its
+FROM clause (see ROWS), so new sql_matrix entries work without changes here.
+A "column > ?" condition skips the rows up to the parameter, for keyset paging.
+
+Row counts and latency can be changed with configure() or the environment:
+  IFXPY_FAKE_ROWS="syssessions=10000,sysdbspaces=500"
+  IFXPY_FAKE_LATENCY=0.005          seconds added to every execute
+"""
+import os
+import re
+import threading
+import time
+
+# Rows per sysmaster table, tables that aren't listed have a single row
+ROWS = {'syssessions':    1000,
+        'sysrstcb':       200,
+        'systhreads':     80,
+        'sysvplst':       10,
+        'sysdbspaces':    20,
+        'syschunks':      20,
+        'sysprofile':     100,
+        'sysbufpool':     2,
+        'syscluster':     0,
+        'syssrcrss':      0,
+        'sysptprof':      10000,
+        'syschkio':       50,
+       }
+# Seconds every execute takes, and per table overrides
+LATENCY = 0.0
+TABLE_LATENCY = {}
+# Rows per (statement, first position), built once so fetching costs no more than it would with a real result set
+results = {}
+# Statistics for the benchmark harness
+executed = 0
+fetched = 0
+lock = threading.Lock()
+
+text_columns = ['name', 'user', 'username', 'host', 'classname', 'server_name', 'nodetype', 'server_status',
+                'connection_status', 'stop_apply', 'log_transmission_status', 'ha_alias', 'hostname',
+                'dbsname', 'tabname']
+
+
+def configure(rows=None, latency=None, table_latency=None):
+    global LATENCY
+    results.clear()
+    if rows is not None:
+        ROWS.update(rows)
+    if latency is not None:
+        LATENCY = latency
+    if table_latency is not None:
+        TABLE_LATENCY.update(table_latency)
+
+
+def configure_from_environment():
+    rows = {}
+    for entry in os.environ.get('IFXPY_FAKE_ROWS', '').split(','):
+        if '=' in entry:
+            table, _, count = entry.partition('=')
+            rows[table.strip()] = int(count)
+    latency = os.environ.get('IFXPY_FAKE_LATENCY')
+    configure(rows=rows, latency=float(latency) if latency else None)
+
+
+def split_top_level(text, separator=','):
+    parts = []
+    depth = 0
+    current = []
+    for character in text:
+        if character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        if character == separator and depth == 0:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(character)
+    parts.append(''.join(current))
+    return parts
+
+
+def top_level_text(sql):
+    # The statement with everything between parentheses blanked out
+    depth = 0
+    characters = []
+    for character in sql:
+        if character == '(':
+            depth += 1
+        characters.append(character if depth == 0 else ' ')
+        if character == ')':
+            depth -= 1
+    return ''.join(characters)
+
+
+class Statement(object):
+
+    def __init__(_self, sql):
+        _self.sql = sql
+        flat = top_level_text(sql)
+        select = re.search(r"\bSELECT\b", flat, re.IGNORECASE)
+        source = re.search(r"\bFROM\b", flat, re.IGNORECASE)
+        select_list = sql[select.end():source.start()]
+        first = re.match(r"\s*FIRST\s+(\d+)", select_list, re.IGNORECASE)
+        _self.first = None
+        if first:
+            _self.first = int(first.group(1))
+            select_list = select_list[first.end():]
+        _self.columns = [re.search(r"(\w+)\s*$", item.strip()).group(1).lower() for item in split_top_level(select_list)]
+        tail = re.split(r"\b(?:WHERE|GROUP|ORDER)\b", flat[source.end():], flags=re.IGNORECASE)[0]
+        _self.tables = [table.lower() for table in re.findall(r"\b(sys\w+)\b", tail, re.IGNORECASE)]
+        # Aggregates without GROUP BY come back as a single row
+        _self.aggregate = (re.search(r"\bGROUP\b", flat, re.IGNORECASE) is None and
+                           re.match(r"\s*(COUNT|SUM|MIN|MAX|AVG)\s*\(", split_top_level(select_list)[0], re.IGNORECASE) is not None)
+        keyset = re.search(r"\b(\w+)\s*>\s*\?", flat)
+        _self.keyset = keyset.group(1).lower() if keyset else None
+        _self.start = 0
+        _self.rows = iter([])
+
+    def bind(_self, params):
+        # Every value is position * 7 + 1, so the first row past the key is easy to find
+        _self.start = 0
+        if _self.keyset is not None and params:
+            _self.start = max(int(params[0]) + 6, 0) // 7
+
+    def row_count(_self):
+        if _self.aggregate:
+            return 1
+        count = max(max([ROWS.get(table, 1) for table in _self.tables] or [1]) - _self.start, 0)
+        if _self.first is not None:
+            count = min(count, _self.first)
+        return count
+
+    def latency(_self):
+        return max([TABLE_LATENCY.get(table, LATENCY) for table in _self.tables] or [LATENCY])
+
+    def value(_self, column, position):
+        if column == 'version':
+            return '14.10.FC5WE'
+        if column == 'mode':
+            return 5
+        if column == 'threadstate':
+            return position % 8
+        if column == 'pagesize':
+            return 2048 << (position % 4)
+        if column == 'host' and position % 10 == 0:
+            # Shared memory connections have no host
+            return ''
+        if column in text_columns:
+            return '{0}{1}'.format(column, position)
+        if column in ['total', 'series']:
+            # Totals behind a FIRST n statement: every table row is its own series, counting position * 7 + 1
+            rows = max([ROWS.get(table, 1) for table in _self.tables])
+            return rows if column == 'series' else 7 * rows * (rows - 1) // 2 + rows
+        return position * 7 + 1
+
+    def result(_self):
+        key = (_self.sql, _self.start)
+        rows = results.get(key)
+        if rows is None:
+            columns = _self.columns
+            rows = [tuple([_self.value(column, position) for column in columns]) for position in xrange(_self.start, _self.start + _self.row_count())]
+            results[key] = rows
+        return rows
+
+
+def execute(stat, params=None):
+    global executed
+    stat.bind(params)
+    latency = stat.latency()
+    if latency > 0:
+        time.sleep(latency)
+    stat.rows = iter(stat.result())
+    with lock:
+        executed += 1
+    return True
+
+
+def connect(connstr, user, password):
+    return object()
+
+
+def close(connection):
+    return True
+
+
+def prepare(connection, sql):
+    return Statement(sql)
+
+
+def exec_immediate(connection, sql):
+    stat = Statement(sql)
+    execute(stat)
+    return stat
+
+
+def fetch_tuple(stat):
+    global fetched
+    row = next(stat.rows, False)
+    if row:
+        fetched += 1
+    return row
+
+
+def fetch_assoc(stat):
+    row = fetch_tuple(stat)
+    return dict(zip(stat.columns, row)) if row else False
+
+
+def num_fields(stat):
+    return len(stat.columns)
+
+
+def field_name(stat, position):
+    return stat.columns[position]
+
+
+def free_result(stat):
+    stat.rows = iter([])
+    return True
+
+
+def free_stmt(stat):
+    return True
+
+
+configure_from_environment()
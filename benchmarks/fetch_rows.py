@@ -0,0 +1,65 @@
+"""
+Before/after benchmark of the row fetching path, without an Informix server.
+
+The old path fetched every row with fetch_assoc(), copied it into a second dict
+and str()'d every value before add_metric(). The new path streams fetch_tuple()
+rows straight into the metric families through InformixCollector.fetch_rows().
+Rows come from the simulated sysmaster in benchmarks/IfxPy.py.
+
+Usage: python benchmarks/fetch_rows.py [rows] [repeats]
+"""
+import os
+import sys
+import time
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+REPEATS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+# This directory first, so the collector picks up the simulated IfxPy
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IfxPy
+from prometheus_client.core import GaugeMetricFamily
+from informix_prometheus_collector import InformixCollector
+
+
+def old_session_info(collector):
+    # execute_sql() and get_session_info() as they were before fetch_rows()
+    stat = IfxPy.exec_immediate(None, collector.sql_matrix[collector.version]['sessions'])
+    res = IfxPy.fetch_assoc(stat)
+    records = []
+    while res:
+        row = {}
+        for key in res.keys():
+            row[key] = res[key]
+        records.append(row)
+        res = IfxPy.fetch_assoc(stat)
+    sessions = GaugeMetricFamily('node_ifx_sessions', 'Informix sessions', labels=['ifxserver', 'host', 'user'])
+    for record in records:
+        if record['host'] == '':
+            sessions.add_metric([collector.dbhostname, "SHMEM", record['user']], str(record['count']))
+        else:
+            sessions.add_metric([collector.dbhostname, record['host'], record['user']], str(record['count']))
+    return sessions
+
+
+def measure(function):
+    timings = []
+    for repeat in range(REPEATS):
+        t0 = time.time()
+        function()
+        timings.append(time.time() - t0)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+if __name__ == '__main__':
+    IfxPy.configure(rows={'syssessions': ROWS})
+    collector = InformixCollector(database='bench', hostname='localhost', port='9088', user='informix', password='informix')
+    before = measure(lambda: old_session_info(collector))
+    after = measure(lambda: collector.get_session_info())
+    print "{0} session rows, median of {1} runs".format(ROWS, REPEATS)
+    print "  fetch_assoc + copy + str(): {0:8.2f} ms".format(before * 1000)
+    print "  fetch_rows (fetch_tuple):   {0:8.2f} ms".format(after * 1000)
+    print "  speedup:                    {0:8.2f}x".format(before / after)
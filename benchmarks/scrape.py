@@ -0,0 +1,108 @@
+"""
+Scrape benchmark against the simulated sysmaster in benchmarks/IfxPy.py.
+
+Drives InformixCollector.collect() directly and through the exporter's own
+HTTP handler, plain, gzipped and conditional, and reports scrape latency
+percentiles, CPU time and peak memory.
+
+Usage: python benchmarks/scrape.py [--rows syssessions=10000 --rows sysdbspaces=500 ...]
+                                   [--latency 0.002] [--scrapes 50] [--pool-size 4] [--no-batch] [--refresh-tiers] [--cache-ttl 15]
+"""
+import argparse
+import os
+import resource
+import sys
+import threading
+import time
+import urllib2
+
+# This directory first, so the collector picks up the simulated IfxPy
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IfxPy
+from prometheus_client import generate_latest
+from prometheus_client.core import CollectorRegistry
+from informix_prometheus_collector import InformixCollector, ExpositionCache, ExporterHandler, ThreadingHTTPServer
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(name, scrapes, scrape, unit):
+    # One warm-up scrape, so connecting and preparing statements don't count
+    size = len(scrape())
+    executed = IfxPy.executed
+    timings = []
+    cpu0 = cpu_time()
+    for attempt in range(scrapes):
+        t0 = time.time()
+        scrape()
+        timings.append(time.time() - t0)
+    cpu = cpu_time() - cpu0
+    print "{0:<8} p50 {1:8.2f} ms  p90 {2:8.2f} ms  p99 {3:8.2f} ms  max {4:8.2f} ms  cpu/scrape {5:8.2f} ms  statements/scrape {6:5.1f}  {7} {8}".format(
+        name, percentile(timings, 0.5) * 1000, percentile(timings, 0.9) * 1000, percentile(timings, 0.99) * 1000,
+        max(timings) * 1000, cpu / scrapes * 1000, float(IfxPy.executed - executed) / scrapes, size, unit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows",      action="append", default=[], metavar="TABLE=COUNT", help="Rows in a sysmaster table, eg: syssessions=10000. Can be repeated")
+    parser.add_argument("--latency",   type=float, default=0.0, help="Seconds every simulated statement takes")
+    parser.add_argument("--scrapes",   type=int, default=50, help="Number of measured scrapes")
+    parser.add_argument("--pool-size", type=int, default=1, help="Passed on to the collector")
+    parser.add_argument("--no-batch",  dest="batch", action="store_false", help="Passed on to the collector")
+    parser.add_argument("--queries",   help="Passed on to the collector")
+    parser.add_argument("--cache-ttl", type=float, default=0, help="Seconds the http stages reuse a rendering, like the exporter's --cache-ttl")
+    parser.add_argument("--refresh-tiers", action="store_true", help="Keep the default refresh intervals instead of running every statement on every scrape")
+    args = parser.parse_args()
+    rows = {}
+    for entry in args.rows:
+        table, _, count = entry.partition('=')
+        rows[table] = int(count)
+    IfxPy.configure(rows=rows, latency=args.latency)
+
+    # Every scrape runs every statement, unless the cached tiers are what's being measured
+    refresh = None if args.refresh_tiers else dict((sql_name, 0) for sql_name in InformixCollector.refresh_matrix.keys())
+    collector = InformixCollector(database='bench', hostname='localhost', port='9088', user='informix', password='informix',
+                                  refresh=refresh, pool_size=args.pool_size, batch=args.batch, queries=args.queries)
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(collector)
+    # Keep the collector quiet, its per run log line would dominate the output
+    collector.print_info = lambda message: None
+
+    print "rows: {0}".format(', '.join('{0}={1}'.format(table, count) for table, count in sorted(IfxPy.ROWS.items())))
+    print "latency per statement: {0} s, pool size {1}, batch {2}, {3} scrapes".format(args.latency, args.pool_size, args.batch, args.scrapes)
+    measure('collect', args.scrapes, lambda: list(collector.collect()), 'families')
+    measure('render', args.scrapes, lambda: generate_latest(registry), 'bytes')
+
+    ExporterHandler.cache = ExpositionCache(registry, args.cache_ttl)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ExporterHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    url = 'http://127.0.0.1:{0}/metrics'.format(server.server_port)
+    measure('http', args.scrapes, lambda: urllib2.urlopen(url).read(), 'bytes')
+    measure('http-gz', args.scrapes, lambda: urllib2.urlopen(urllib2.Request(url, headers={'Accept-Encoding': 'gzip'})).read(), 'bytes')
+    response = urllib2.urlopen(url)
+    response.read()
+    etag = response.info()['ETag']
+
+    def conditional():
+        # A 304 only happens while the rendering is reused, so with --cache-ttl
+        try:
+            return urllib2.urlopen(urllib2.Request(url, headers={'If-None-Match': etag})).read()
+        except urllib2.HTTPError, e:
+            if e.code != 304:
+                raise
+            return ''
+    measure('http-304', args.scrapes, conditional, 'bytes')
+    server.shutdown()
+    print "peak memory: {0:.1f} MiB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
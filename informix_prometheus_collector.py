@@ -1,17 +1,178 @@
 from datetime import datetime
-from prometheus_client import start_http_server
-from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY, UntypedMetricFamily, InfoMetricFamily
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY, UntypedMetricFamily, InfoMetricFamily, HistogramMetricFamily, CollectorRegistry
+from multiprocessing.pool import ThreadPool
 import argparse
+import array
+import BaseHTTPServer
+import hashlib
+import heapq
 import IfxPy
+import json
 import os
+import Queue
 import re
+import SocketServer
 import sys
+import threading
 import time
+import urlparse
+import zlib
+try:
+    import yaml
+except ImportError:
+    # Only needed for YAML target and query files, JSON works without it
+    yaml = None
 
 
+def load_config_file(path):
+    with open(path) as config_file:
+        if path.endswith(('.yml', '.yaml')):
+            if yaml is None:
+                raise Exception('PyYAML is needed to read {0} - install it or use a JSON file.'.format(path))
+            return yaml.safe_load(config_file)
+        return json.load(config_file)
+
+
+
+def write_if_changed(path, content):
+    # Leaves the file alone when it already holds content, otherwise replaces it in one go
+    try:
+        with open(path) as current:
+            if current.read() == content:
+                return False
+    except IOError:
+        pass
+    temporary = '{0}.{1}'.format(path, os.getpid())
+    with open(temporary, 'w') as output:
+        output.write(content)
+    os.rename(temporary, path)
+    return True
+
+
+class NotConnected(Exception):
+    # A statement couldn't run because there is no connection to Informix
+    pass
+
+class ConnectionPool(object):
+
+    # Idle connections, None marks a slot that still has to (re)connect
+    idle = None
+    size = 1
+
+    def __init__(_self, size):
+        _self.size = size
+        _self.idle = Queue.Queue()
+        for slot in range(size):
+            _self.idle.put(None)
+
+    def acquire(_self):
+        return _self.idle.get()
+
+    def release(_self, connection):
+        _self.idle.put(connection)
+
+    def abandon(_self):
+        # A connection stuck in a statement nobody waits for anymore is replaced by a fresh slot.
+        # It doesn't come back to the pool, it's closed once the statement returns.
+        _self.idle.put(None)
+
+    def close(_self, disconnect):
+        # Only idle connections are closed, the collector closes one that is in use when it is handed back
+        for slot in range(_self.idle.qsize()):
+            connection = _self.idle.get()
+            if connection is not None:
+                disconnect(connection)
+            _self.idle.put(None)
+
+
+
+class RingBuffer(object):
+
+    # Keeps the last size values and their timestamps in flat arrays of doubles, so memory doesn't grow with the scrape interval
+    def __init__(_self, size):
+        _self.size = size
+        _self.times = array.array('d', [0.0]) * size
+        _self.values = array.array('d', [0.0]) * size
+        _self.written = 0
+
+    def append(_self, stamp, value):
+        position = _self.written % _self.size
+        _self.times[position] = stamp
+        _self.values[position] = value
+        _self.written += 1
+
+    def since(_self, stamp):
+        # The values appended at or after stamp that are still kept, newest first, and the time of the oldest one.
+        # Nothing is consumed, every scraper gets the same window
+        values = []
+        oldest = None
+        for position in xrange(_self.written - 1, max(_self.written - _self.size, 0) - 1, -1):
+            index = position % _self.size
+            if _self.times[index] < stamp:
+                break
+            values.append(_self.values[index])
+            oldest = _self.times[index]
+        return values, oldest
+
 class InformixCollector(object):
     
-    connection = None
+    pool = None
+    # Number of connections, and queries running in parallel
+    pool_size = 1
+    # Runs the metric functions concurrently when pool_size > 1
+    workers = None
+    # Prepared statements per connection: {connection: {sql: statement}}
+    statements = None
+    # Guards the bookkeeping shared between connections. A connection itself is only ever used
+    # by the thread that took it from the pool.
+    connection_lock = None
+    # Rows of the sample_matrix tables read per collection, 0 doesn't collect them at all.
+    # Every table gets an equal share, which is the FIRST of its statement, so the server never sends more
+    sample_rows = 0
+    sample_share = 0
+    # Objects per sample_matrix table that get their own series
+    sample_top = 20
+    # Merged view per sample_matrix table: {sql_name: {'after': key, 'objects': {key: row}, 'heat': {key: rate}, ...}}
+    samples = None
+    sample_lock = None
+    # Seconds between two runs of the watch_matrix statements, 0 doesn't run them
+    watch_interval = 0
+    # Seconds of samples a collection summarizes, the same for every scraper
+    watch_window = 60
+    # Samples kept per watched value, when the window holds more only the newest ones are summarized
+    watch_samples = 1024
+    # {(sql_name, key, column): RingBuffer}
+    watches = None
+    watch_lock = None
+    # Seconds a metric_matrix entry, and a whole collection, may take before it is abandoned. 0 means no limit
+    query_timeout = 0
+    scrape_timeout = 0
+    # After this many timeouts in a row an entry is skipped for breaker_cooldown seconds
+    breaker_threshold = 3
+    breaker_cooldown = 300
+    # {sql_name: [timeouts in a row, skipped until]}
+    breakers = None
+    # Outcome of every metric_matrix entry in the last collection with deadlines: {sql_name: 'ok'|'error'|'timeout'|'skipped'}
+    query_status = None
+    # Per worker thread: the task it runs for a collection with deadlines, see new_task()
+    current = None
+    # The collection in progress that concurrent collect() calls wait for: {'done': Event, 'metrics': [...], 'error': ...}
+    flight = None
+    flight_lock = None
+    # Column names per sql statement as returned by the server
+    columns = None
+    # Per sql statement duration histogram, row, error and reconnect counts: {sql_name: {...}}
+    query_stats = None
+    stats_lock = None
+    duration_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf')]
+    # Log every sql statement taking at least this many seconds, 0 disables it
+    slow_query_log = 0
+    # Maximum series for sessions and locks per user, the rest is folded into 'other'. 0 means no limit
+    max_series = 0
+    # Series folded into 'other' by the last collection: {metric name: count}
+    dropped_series = None
     connstr = ''
     # Version can be [11,12,14]
     version = 12
@@ -19,6 +180,29 @@ class InformixCollector(object):
     dbhostname = ""
     # If empty, we'll try to figure it out ourselves
     ha_alias = ""
+    # dbhostname, ha_alias and version as found last time, so a restart has them before Informix answers
+    state_file = None
+    # Set once connecting and looking up dbhostname, ha_alias and version worked
+    discovered = None
+    # Set after the first try, collections wait at most discovery_wait seconds for it instead of connecting themselves
+    attempted = None
+    discovery_wait = 1
+    # Seconds between discovery attempts, doubling up to the maximum
+    discovery_backoff = 1
+    discovery_backoff_max = 60
+    # Run on every collection to tell a working connection from a stale one
+    ping_sql = "SELECT FIRST 1 tabid FROM systables"
+    # Seconds between background refreshes, 0 collects inside the scrape itself
+    interval = 0
+    # Cleared by close() to stop the background threads, connections handed back afterwards are closed
+    running = True
+    running_lock = None
+    # Latest completed collection when running with a background poller
+    snapshot = None
+    snapshot_time = None
+    snapshot_lock = None
+    # Cached metric families per sql_matrix entry: {sql_name: (expiry timestamp, [metrics])}
+    metric_cache = None
     # Bitshifting (<<) 30 times to go from GiB to bytes
     memory_matrix = { 11: {'DE': 1<<30,
                            'EE': 1<<30,
@@ -55,53 +239,90 @@ class InformixCollector(object):
                         'rss_transmit_status':     'SELECT TRIM(server_name) as server_name, TRIM(log_transmission_status) as log_transmission_status FROM syssrcrss;',
                         'ha_alias':                'SELECT TRIM(cf_effective) as ha_alias FROM sysconfig WHERE cf_name = "HA_ALIAS";',
                         'hostname':                'SELECT TRIM(cf_default) as hostname FROM sysconfig WHERE cf_name = "DBSERVERNAME";',
-                       },
-                   12: {'uptime_mode':             'SELECT (sh_curtime-sh_boottime) as online, sh_mode as mode FROM sysshmvals;',
-                        'version':                 'SELECT FIRST 1 TRIM(version) as version FROM syslicenseinfo ORDER BY year,week DESC;',
-                        'memory':                  'SELECT SUM(seg_size) as total_size FROM sysseglst;',
-                        'sessions':                'SELECT TRIM(username) as user, TRIM(hostname) as host, COUNT(username) as count FROM syssessions GROUP BY 1,2;',
-                        'config_changes':          'SELECT count(cf_id) as count FROM syscfgtab WHERE cf_effective != cf_original AND cf_original != \'\' AND cf_id not in (5,8,11,31,45,47,51,53,54,58,67,79,122,128,129,172,177,182,201,216,234,278,281,288,288,310,311);',
-                        'dbspace_sizes':           'SELECT TRIM(sysdbspaces.name) as name, SUM(syschunks.chksize*sh_pagesize) as size, SUM(syschunks.nfree*sh_pagesize) as free FROM sysshmvals,syschunks JOIN sysdbspaces ON syschunks.dbsnum = sysdbspaces.dbsnum GROUP BY 1 ORDER BY NAME;',
-                        'sysprofile':              'SELECT TRIM(name) as name, value FROM sysprofile;',
-                        'vpu_class':               'SELECT TRIM(classname) as classname, SUM(usecs_user) as usecs_user, SUM(usecs_sys) as usecs_sys, SUM(readyqueue) as readyqueue, SUM(num_ready) as num_ready , CAST(COUNT(*) - SUM(num_ready) AS INT) idle, SUM(total_semops) semops, SUM(total_busy_wts) busy_waits, SUM(total_spins) spins FROM sysvplst GROUP BY classname;',
-                        'open_transactions':       'SELECT COUNT(*) as open_transactions FROM systrans;',
-                        'locks_per_user':          'SELECT TRIM(username) as username, SUM(nlocks) as locks FROM sysrstcb GROUP BY 1;',
-                        'mutexes':                 'SELECT COUNT(*) as mutex_count FROM sysmutexes WHERE mtx_holder != 0;',
-                        'threads':                 'SELECT TRIM(classname) as classname, th_state as threadstate, count(th_id) as count FROM systhreads JOIN sysvplst ON systhreads.th_vpid = sysvplst.vpid GROUP BY 1,2;',
-                        'buffers':                 'SELECT SUM(bufsize*nbuffs) as size, SUM(dskreads) as dskreads, SUM(pagreads) as pagreads, SUM(bufreads) as bufreads, SUM(dskwrites) as dskwrites, SUM(pagwrites) as pagwrites, SUM(bufwrites) as bufwrites, SUM(bufwaits) as bufwaits, SUM(ovbuff) as ovbuff, SUM(flushes) as flushes, SUM(fgwrites) as fgwrites, SUM(lruwrites) as lruwrites, SUM(chunkwrites) as chunkwrites, SUM(lru_time_total) as lru_time_total, SUM(lru_calls) as lru_calls, ((pagreads + bufwrites) / nbuffs) as buffer_turnovers, bufsize as pagesize from sysbufpool GROUP BY 16,17;',
-                        'slow_queries':            'SELECT COUNT(net_last_write) as slow_queries FROM sysnetworkio WHERE net_last_write-net_last_read>1;',
-                        'rss_role':                'SELECT server_name FROM syssrcrss;',
-                        'rss_info':                'SELECT TRIM(name) as name, TRIM(nodetype) as nodetype, TRIM(server_status) as server_status, TRIM(connection_status) as connection_status, delayed_apply as delayed_apply, TRIM(stop_apply) as stop_apply, (((logid_sent*3580)+logpage_sent) - ((logid_acked*3580)+logpage_acked)) as lag FROM syscluster;',
-                        'rss_transmit_status':     'SELECT TRIM(server_name) as server_name, TRIM(log_transmission_status) as log_transmission_status FROM syssrcrss;',
-                        'ha_alias':                'SELECT TRIM(cf_effective) as ha_alias FROM sysconfig WHERE cf_name = "HA_ALIAS";',
-                        'hostname':                'SELECT TRIM(cf_default) as hostname FROM sysconfig WHERE cf_name = "DBSERVERNAME";',
-                       },
-                   14: {'uptime_mode':             'SELECT (sh_curtime-sh_boottime) as online, sh_mode as mode FROM sysshmvals;',
-                        'version':                 'SELECT FIRST 1 TRIM(version) as version FROM syslicenseinfo ORDER BY year,week DESC;',
-                        'memory':                  'SELECT SUM(seg_size) as total_size FROM sysseglst;',
-                        'sessions':                'SELECT TRIM(username) as user, TRIM(hostname) as host, COUNT(username) as count FROM syssessions GROUP BY 1,2;',
-                        'config_changes':          'SELECT count(cf_id) as count FROM syscfgtab WHERE cf_effective != cf_original AND cf_original != \'\' AND cf_id not in (5,8,11,31,45,47,51,53,54,58,67,79,122,128,129,172,177,182,201,216,234,278,281,288,288,310,311);',
-                        'dbspace_sizes':           'SELECT TRIM(sysdbspaces.name) as name, SUM(syschunks.chksize*sh_pagesize) as size, SUM(syschunks.nfree*sh_pagesize) as free FROM sysshmvals,syschunks JOIN sysdbspaces ON syschunks.dbsnum = sysdbspaces.dbsnum GROUP BY 1 ORDER BY NAME;',
-                        'sysprofile':              'SELECT TRIM(name) as name, value FROM sysprofile;',
-                        'vpu_class':               'SELECT TRIM(classname) as classname, SUM(usecs_user) as usecs_user, SUM(usecs_sys) as usecs_sys, SUM(readyqueue) as readyqueue, SUM(num_ready) as num_ready , CAST(COUNT(*) - SUM(num_ready) AS INT) idle, SUM(total_semops) semops, SUM(total_busy_wts) busy_waits, SUM(total_spins) spins FROM sysvplst GROUP BY classname;',
-                        'open_transactions':       'SELECT COUNT(*) as open_transactions FROM systrans;',
-                        'locks_per_user':          'SELECT TRIM(username) as username, SUM(nlocks) as locks FROM sysrstcb GROUP BY 1;',
-                        'mutexes':                 'SELECT COUNT(*) as mutex_count FROM sysmutexes WHERE mtx_holder != 0;',
-                        'threads':                 'SELECT TRIM(classname) as classname, th_state as threadstate, count(th_id) as count FROM systhreads JOIN sysvplst ON systhreads.th_vpid = sysvplst.vpid GROUP BY 1,2;',
-                        'buffers':                 'SELECT SUM(bufsize*nbuffs) AS size, SUM(dskreads) AS dskreads, SUM(pagreads) AS pagreads, SUM(bufreads) AS bufreads, SUM(dskwrites) AS dskwrites, SUM(pagwrites) AS pagwrites, SUM(bufwrites) AS bufwrites, SUM(bufwaits) AS bufwaits, SUM(ovbuff) AS ovbuff, SUM(flushes) AS flushes, SUM(fgwrites) AS fgwrites, SUM(lruwrites) AS lruwrites, SUM(chunkwrites) AS chunkwrites, SUM(lru_time_total) AS lru_time_total, SUM(lru_calls) AS lru_calls, ((pagreads + bufwrites) / nbuffs) AS buffer_turnovers, bufsize AS pagesize from sysbufpool GROUP BY 16,17;',
-                        'slow_queries':            'SELECT COUNT(net_last_write) as slow_queries FROM sysnetworkio WHERE net_last_write-net_last_read>1;',
-                        'rss_role':                'SELECT server_name FROM syssrcrss;',
-                        'rss_info':                'SELECT TRIM(name) as name, TRIM(nodetype) as nodetype, TRIM(server_status) as server_status, TRIM(connection_status) as connection_status, delayed_apply as delayed_apply, TRIM(stop_apply) as stop_apply, (((logid_sent*3580)+logpage_sent) - ((logid_acked*3580)+logpage_acked)) as lag FROM syscluster;',
-                        'rss_transmit_status':     'SELECT TRIM(server_name) as server_name, TRIM(log_transmission_status) as log_transmission_status FROM syssrcrss;',
-                        'ha_alias':                'SELECT TRIM(cf_effective) as ha_alias FROM sysconfig WHERE cf_name = "HA_ALIAS";',
-                        'hostname':                'SELECT TRIM(cf_default) as hostname FROM sysconfig WHERE cf_name = "DBSERVERNAME";',
+                        'sessions_top':            'SELECT FIRST {limit} TRIM(username) as user, TRIM(hostname) as host, COUNT(username) as count FROM syssessions GROUP BY 1,2 ORDER BY 3 DESC;',
+                        'sessions_total':          'SELECT COUNT(*) as total, COUNT(DISTINCT NVL(username,\'\')||\'@\'||NVL(hostname,\'\')) as series FROM syssessions;',
+                        'locks_per_user_top':      'SELECT FIRST {limit} TRIM(username) as username, SUM(nlocks) as locks FROM sysrstcb GROUP BY 1 ORDER BY 2 DESC;',
+                        'locks_per_user_total':    'SELECT SUM(nlocks) as total, COUNT(DISTINCT username) as series FROM sysrstcb;',
+                        'partitions_shard':        'SELECT FIRST {limit} partnum, TRIM(dbsname) as dbsname, TRIM(tabname) as tabname, pagreads, pagwrites, bufreads, bufwrites, seqscans FROM sysptprof WHERE partnum > ? ORDER BY partnum;',
+                        'chunk_io_shard':          'SELECT FIRST {limit} chunknum, reads, writes, pagesread, pageswritten FROM syschkio WHERE chunknum > ? ORDER BY chunknum;',
+                        'watch_buffers':           'SELECT SUM(bufwaits) as bufwaits, SUM(fgwrites) as fgwrites, SUM(ovbuff) as ovbuff FROM sysbufpool;',
+                        'watch_ready_queue':       'SELECT TRIM(classname) as classname, SUM(readyqueue) as readyqueue FROM sysvplst GROUP BY classname;',
+                        'watch_sysprofile':        'SELECT TRIM(name) as name, value FROM sysprofile WHERE name IN (\'latchwts\', \'buffwts\', \'lockwts\', \'ckptwts\', \'deadlks\', \'lktouts\');',
                        }
                  }
-                     
+    # Later versions start from the statements of the version before and only replace what differs
+    sql_matrix[12] = dict(sql_matrix[11])
+    sql_matrix[14] = dict(sql_matrix[12])
+    # Which function turns which sql_matrix entry into metrics, in the order they are exposed
+    metric_matrix = [('config_changes',    'get_config_changes'),
+                     ('locks_per_user',    'get_locks_per_user'),
+                     ('mutexes',           'get_mutex_info'),
+                     ('open_transactions', 'get_open_transaction_info'),
+                     ('slow_queries',      'get_slow_queries'),
+                     ('sessions',          'get_session_info'),
+                     ('threads',           'get_thread_info'),
+                     ('buffers',           'get_buffer_info'),
+                     ('dbspace_sizes',     'get_dbspaces_info'),
+                     ('version',           'get_version_info'),
+                     ('memory',            'get_memory_info'),
+                     ('rss_info',          'get_rss_info'),
+                     ('sysprofile',        'get_sysprofile_info'),
+                     ('uptime_mode',       'get_uptime_and_mode_info'),
+                     ('vpu_class',         'get_vpu_class_info'),
+                    ]
+    # Single row statements that are fetched together through 'scalars' when batching
+    scalar_matrix = ['config_changes', 'mutexes', 'open_transactions', 'slow_queries', 'memory', 'uptime_mode']
+    # What each of them adds to the select list of 'scalars', which is built from the ones still batched
+    scalar_columns = {'uptime_mode':       ['(sh_curtime-sh_boottime) as online', 'sh_mode as mode'],
+                      'open_transactions': ['(SELECT COUNT(*) FROM systrans) as open_transactions'],
+                      'mutexes':           ['(SELECT COUNT(*) FROM sysmutexes WHERE mtx_holder != 0) as mutex_count'],
+                      'slow_queries':      ['(SELECT COUNT(net_last_write) FROM sysnetworkio WHERE net_last_write-net_last_read>1) as slow_queries'],
+                      'config_changes':    ['(SELECT count(cf_id) FROM syscfgtab WHERE cf_effective != cf_original AND cf_original != \'\' AND cf_id not in (5,8,11,31,45,47,51,53,54,58,67,79,122,128,129,172,177,182,201,216,234,278,281,288,288,310,311)) as count'],
+                      'memory':            ['(SELECT SUM(seg_size) FROM sysseglst) as total_size'],
+                     }
+    # Big per object tables that are read a shard at a time, see get_sampled_info().
+    # key orders the shards, the objects with the most rank I/O are reported one by one, the rest only in totals.
+    # names are the label names for the key and the label columns
+    sample_matrix = [('partitions_shard', {'key':    'partnum',
+                                           'labels': ('dbsname', 'tabname'),
+                                           'names':  ('partnum', 'database', 'table'),
+                                           'values': ('pagreads', 'pagwrites', 'bufreads', 'bufwrites', 'seqscans'),
+                                           'rank':   ('pagreads', 'pagwrites'),
+                                           'prefix': 'partition',
+                                           'help':   'partition',
+                                          }),
+                     ('chunk_io_shard',   {'key':    'chunknum',
+                                           'labels': (),
+                                           'names':  ('chunk',),
+                                           'values': ('reads', 'writes', 'pagesread', 'pageswritten'),
+                                           'rank':   ('pagesread', 'pageswritten'),
+                                           'prefix': 'chunk',
+                                           'help':   'chunk',
+                                          }),
+                    ]
+    # Cheap statements the watcher runs many times between scrapes, see watch().
+    # Counters are kept as the rate between two samples, the other values as they are
+    watch_matrix = [('watch_buffers',     {'labels': (),             'values': ('bufwaits', 'fgwrites', 'ovbuff'), 'counter': True}),
+                    ('watch_ready_queue', {'labels': ('classname',), 'values': ('readyqueue',),                    'counter': False}),
+                    ('watch_sysprofile',  {'labels': ('name',),      'values': ('value',),                         'counter': True}),
+                   ]
+    watch_quantiles = [0, 0.5, 0.9, 0.99, 1]
+    # Metric types a query definition file can map columns to
+    metric_types = {'gauge':   GaugeMetricFamily,
+                    'counter': CounterMetricFamily,
+                    'untyped': UntypedMetricFamily,
+                   }
+    # Seconds a result stays valid before the query runs again, anything not listed runs on every collection
+    refresh_matrix = {'version':        3600,
+                      'dbspace_sizes':  300,
+                      'config_changes': 300,
+                      'sysprofile':     60,
+                     }
     
-    def __init__(_self, database, hostname, port, user, password):
+    def __init__(_self, database, hostname, port, user, password, interval=0, refresh=None, pool_size=1, sqlhostsfile=None, batch=True, slow_query_log=0, queries=None, max_series=0, query_timeout=0, scrape_timeout=0, breaker_threshold=3, breaker_cooldown=300, sample_rows=0, sample_top=20, state_file=None, watch_interval=0, watch=None, watch_samples=1024, watch_window=60):
         _self.connstr = "SERVER={0};DATABASE=sysmaster;HOST={1};SERVICE={2};UID={3};PWD={4};".format(database, hostname, port, user, password)
-        sqlhostsfile = _self.write_sqlhosts_file(database, hostname, port)
+        if sqlhostsfile is None:
+            sqlhostsfile = _self.write_sqlhosts_file(database, hostname, port)
         informixdir = '/opt/IBM/Informix_Client-SDK/'
         os.environ['INFORMIXDIR'] = informixdir
         os.environ['LD_LIBRARY_PATH'] = '{0}/lib/:{0}/lib/esql/:{0}/lib/cli/'.format(informixdir)
@@ -110,17 +331,197 @@ class InformixCollector(object):
         # Checking some configuration parameters
         if _self.version not in _self.sql_matrix.keys():
             raise Exception('Version not in SQL Matrix - bailing out.')
-        _self.connect()
-        # Setting some normally never changing values
-        if _self.ha_alias == "":
-            records = _self.execute_sql("ha_alias")
-            if len(records) == 1:
-                _self.ha_alias = records[0]['ha_alias']
-        if _self.dbhostname == "":
-            records = _self.execute_sql("hostname")
-            if len(records) == 1:
-                _self.dbhostname = records[0]['hostname']
-        pass
+        _self.refresh_matrix = dict(_self.refresh_matrix)
+        if queries is not None:
+            _self.load_queries(queries)
+        _self.max_series = max_series
+        _self.dropped_series = {}
+        _self.sample_rows = sample_rows
+        _self.sample_top = sample_top
+        limits = {}
+        if _self.max_series > 0:
+            # The server picks the biggest ones, only those travel over the wire
+            limits.update({'sessions_top': _self.max_series, 'locks_per_user_top': _self.max_series})
+        if _self.sample_rows > 0:
+            _self.sample_share = max(_self.sample_rows // len(_self.sample_matrix), 1)
+            for sql_name, sample in _self.sample_matrix:
+                limits[sql_name] = _self.sample_share
+        if limits:
+            _self.sql_matrix = dict((version, dict(statements)) for version, statements in _self.sql_matrix.items())
+            for statements in _self.sql_matrix.values():
+                for sql_name, limit in limits.items():
+                    statements[sql_name] = statements[sql_name].format(limit=limit)
+        if refresh is not None:
+            _self.refresh_matrix.update(refresh)
+        if batch:
+            # One round trip instead of one per single row statement, at the spot of the first one.
+            # Statements with a refresh of their own stay out of it, 'scalars' runs on every collection
+            _self.scalar_matrix = [sql_name for sql_name in _self.scalar_matrix if _self.refresh_matrix.get(sql_name, 0) <= 0]
+            if _self.scalar_matrix:
+                columns = [column for sql_name in _self.scalar_matrix for column in _self.scalar_columns[sql_name]]
+                _self.sql_matrix = dict((version, dict(statements)) for version, statements in _self.sql_matrix.items())
+                for statements in _self.sql_matrix.values():
+                    statements['scalars'] = 'SELECT {0} FROM sysshmvals;'.format(', '.join(columns))
+            metric_matrix = []
+            for sql_name, function in _self.metric_matrix:
+                if sql_name not in _self.scalar_matrix:
+                    metric_matrix.append((sql_name, function))
+                elif ('scalars', 'get_scalar_info') not in metric_matrix:
+                    metric_matrix.append(('scalars', 'get_scalar_info'))
+            _self.metric_matrix = metric_matrix
+        if _self.sample_rows > 0:
+            _self.metric_matrix = _self.metric_matrix + [('sampled_objects', 'get_sampled_info')]
+        if refresh is not None:
+            # A batched statement is still a valid name, with a refresh of 0 it simply stays in 'scalars'
+            names = [entry[0] for entry in _self.metric_matrix] + _self.scalar_matrix
+            for sql_name in refresh.keys():
+                if sql_name not in names:
+                    raise Exception('{0} is not a collected sql statement - bailing out.'.format(sql_name))
+        _self.metric_cache = {}
+        _self.samples = {}
+        _self.sample_lock = threading.Lock()
+        _self.running_lock = threading.Lock()
+        _self.statements = {}
+        _self.connection_lock = threading.Lock()
+        _self.flight_lock = threading.Lock()
+        _self.columns = {}
+        _self.query_stats = {}
+        _self.stats_lock = threading.Lock()
+        _self.slow_query_log = slow_query_log
+        _self.query_timeout = query_timeout
+        _self.scrape_timeout = scrape_timeout
+        _self.breaker_threshold = breaker_threshold
+        _self.breaker_cooldown = breaker_cooldown
+        _self.breakers = {}
+        _self.query_status = {}
+        _self.current = threading.local()
+        _self.pool_size = pool_size
+        _self.pool = ConnectionPool(_self.pool_size)
+        if _self.pool_size > 1 and not _self.has_deadlines():
+            _self.workers = ThreadPool(_self.pool_size)
+        # Connecting happens in the background, so a down or restarting Informix doesn't keep us from starting
+        if state_file is None:
+            state_file = "/tmp/informix-collector.{0}-{1}.json".format(hostname, database)
+        _self.state_file = state_file
+        _self.load_state()
+        _self.discovered = threading.Event()
+        _self.attempted = threading.Event()
+        _self.start_discovery()
+        _self.watch_interval = watch_interval
+        _self.watch_samples = watch_samples
+        _self.watch_window = watch_window
+        _self.watches = {}
+        _self.watch_lock = threading.Lock()
+        if watch is not None:
+            for sql_name in watch:
+                if sql_name not in [entry[0] for entry in InformixCollector.watch_matrix]:
+                    raise Exception('{0} is not a watchable sql statement - bailing out.'.format(sql_name))
+            _self.watch_matrix = [entry for entry in _self.watch_matrix if entry[0] in watch]
+        if _self.watch_interval > 0:
+            _self.start_watcher()
+        _self.interval = interval
+        _self.snapshot_lock = threading.Lock()
+        if _self.interval > 0:
+            _self.start_poller()
+
+    def load_queries(_self, path):
+        config = load_config_file(path)
+        queries = config.get('queries') or {}
+        versions = dict((int(version), entry or {}) for version, entry in (config.get('versions') or {}).items())
+        for version in versions.keys():
+            if version not in _self.sql_matrix.keys():
+                raise Exception('Version {0} in {1} is not in SQL Matrix - bailing out.'.format(version, path))
+        # Work on copies, the class wide statements and functions stay untouched
+        _self.sql_matrix = dict((version, dict(statements)) for version, statements in _self.sql_matrix.items())
+        _self.metric_matrix = list(_self.metric_matrix)
+        _self.scalar_matrix = list(_self.scalar_matrix)
+        base_sql = {}
+        for sql_name, definition in queries.items():
+            definition = definition or {}
+            if 'sql' in definition:
+                base_sql[sql_name] = definition['sql']
+            if 'refresh' in definition:
+                _self.refresh_matrix[sql_name] = float(definition['refresh'])
+            if 'metrics' in definition and sql_name in _self.scalar_matrix:
+                # Its own mapping needs its own statement
+                _self.scalar_matrix.remove(sql_name)
+            names = [entry[0] for entry in _self.metric_matrix]
+            if 'metrics' in definition:
+                mapper = _self.compile_query(sql_name, definition['metrics'])
+                if sql_name in names:
+                    _self.metric_matrix[names.index(sql_name)] = (sql_name, mapper)
+                else:
+                    _self.metric_matrix.append((sql_name, mapper))
+            elif sql_name not in names:
+                raise Exception('Query {0} in {1} has no metrics - bailing out.'.format(sql_name, path))
+        changed = set(base_sql.keys())
+        for version in _self.sql_matrix.keys():
+            version_sql = _self.resolve_version_sql(versions, version, [])
+            changed.update(version_sql.keys())
+            _self.sql_matrix[version].update(base_sql)
+            _self.sql_matrix[version].update(version_sql)
+        # A changed single row statement can't be answered by 'scalars' anymore
+        _self.scalar_matrix = [sql_name for sql_name in _self.scalar_matrix if sql_name not in changed]
+        for sql_name in config.get('disable') or []:
+            _self.metric_matrix = [entry for entry in _self.metric_matrix if entry[0] != sql_name]
+            if sql_name in _self.scalar_matrix:
+                _self.scalar_matrix.remove(sql_name)
+        for sql_name, function in _self.metric_matrix:
+            for version, statements in _self.sql_matrix.items():
+                if sql_name not in statements and sql_name != 'scalars':
+                    raise Exception('Query {0} in {1} has no sql for version {2} - bailing out.'.format(sql_name, path, version))
+
+    def resolve_version_sql(_self, versions, version, seen):
+        # The sql of a version is the sql of the version it inherits from, plus its own
+        if version in seen:
+            raise Exception('Versions {0} inherit from each other - bailing out.'.format(seen))
+        entry = versions.get(version, {})
+        statements = {}
+        if 'inherit' in entry:
+            statements.update(_self.resolve_version_sql(versions, int(entry['inherit']), seen + [version]))
+        statements.update(entry.get('sql') or {})
+        return statements
+
+    def compile_query(_self, sql_name, definitions):
+        # Work out once which column feeds which label and value, so a scrape only copies values around
+        columns = []
+        specs = []
+        for definition in definitions:
+            for option in ['name', 'value']:
+                if option not in definition:
+                    raise Exception('A metric of query {0} has no {1} - bailing out.'.format(sql_name, option))
+            metric_type = definition.get('type', 'gauge')
+            if metric_type not in _self.metric_types.keys():
+                raise Exception('Metric {0} has unknown type {1} - bailing out.'.format(definition['name'], metric_type))
+            labels = definition.get('labels') or []
+            if isinstance(labels, dict):
+                label_names = sorted(labels.keys())
+                label_columns = [labels[label] for label in label_names]
+            else:
+                label_names = list(labels)
+                label_columns = list(labels)
+            positions = []
+            for column in label_columns + [definition['value']]:
+                column = column.lower()
+                if column not in columns:
+                    columns.append(column)
+                positions.append(columns.index(column))
+            specs.append((_self.metric_types[metric_type], definition['name'], definition.get('help', definition['name']), ["ifxserver"] + label_names, tuple(positions[:-1]), positions[-1]))
+        columns = tuple(columns)
+
+        def get_mapped_info():
+            families = []
+            mappers = []
+            for family_type, name, documentation, labels, label_positions, value_position in specs:
+                family = family_type(name, documentation, labels=labels)
+                families.append(family)
+                mappers.append((family.add_metric, label_positions, value_position))
+            dbhostname = _self.dbhostname
+            for row in _self.fetch_rows(sql_name, columns):
+                for add_metric, label_positions, value_position in mappers:
+                    add_metric([dbhostname] + [str(row[position]) for position in label_positions], row[value_position])
+            return families
+        return get_mapped_info
 
     def print_help(_self):
         print "Usage: <scriptname>.py [OPTIONS]"
@@ -142,9 +543,7 @@ class InformixCollector(object):
     def write_sqlhosts_file(_self, database, hostname, port):
         path = "/tmp/sqlhosts.{0}-{1}".format(hostname,database)
         try:
-            sqlfile = open(path, 'w')
-            sqlfile.write("{0} {1} {2} {3}".format(database, 'onsoctcp', hostname, port))
-            sqlfile.close()
+            write_if_changed(path, "{0} {1} {2} {3}".format(database, 'onsoctcp', hostname, port))
         except Exception, e:
             _self.print_error("Could not write sqlhosts file to ".format(path))
             _self.print_error(e)
@@ -159,48 +558,371 @@ class InformixCollector(object):
 
     def connect(_self):
         try:
-            _self.connection = IfxPy.connect(_self.connstr, "", "")
+            return IfxPy.connect(_self.connstr, "", "")
         except Exception, e:
             _self.print_error("Could not connect to db with connection string:{0}".format(_self.connstr))
             _self.print_error(e)
+        return None
 
-    def disconnect(_self):
+    def disconnect(_self, connection):
+        # Prepared statements die with their connection
+        with _self.connection_lock:
+            statements = _self.statements.pop(connection, {})
+        for stat in statements.values():
+            try:
+                IfxPy.free_stmt(stat)
+            except Exception:
+                pass
         try:
-            IfxPy.close(_self.connection)
-            _self.connection = None
+            IfxPy.close(connection)
         except Exception, e:
             _self.print_error("Could not disconnect")
             _self.print_error(e)
 
-    def execute_sql(_self, sql_name):
+    def close(_self):
+        # A connection that is in use when the pool gets closed is closed by release_connection()
+        with _self.running_lock:
+            _self.running = False
+        if _self.workers is not None:
+            _self.workers.close()
+        _self.pool.close(_self.disconnect)
+
+    def load_state(_self):
+        try:
+            with open(_self.state_file) as state_file:
+                state = json.load(state_file)
+        except IOError:
+            return
+        except ValueError, e:
+            _self.print_error("Ignoring {0}: {1}".format(_self.state_file, e))
+            return
+        # Values set in the class itself win over what we found before
+        if type(_self).dbhostname == "" and state.get('dbhostname'):
+            _self.dbhostname = state['dbhostname']
+        if type(_self).ha_alias == "" and state.get('ha_alias'):
+            _self.ha_alias = state['ha_alias']
+        if state.get('version') in _self.sql_matrix.keys():
+            _self.version = state['version']
+        _self.print_info("Starting as {0} (ha_alias {1}, version {2}) from {3}".format(_self.dbhostname, _self.ha_alias, _self.version, _self.state_file))
+
+    def save_state(_self):
+        state = json.dumps({'dbhostname': _self.dbhostname, 'ha_alias': _self.ha_alias, 'version': _self.version}, sort_keys=True)
+        try:
+            write_if_changed(_self.state_file, state)
+        except Exception, e:
+            # Only costs us a warm start
+            _self.print_error("Could not write {0}: {1}".format(_self.state_file, e))
+
+    def start_discovery(_self):
+        discovery = threading.Thread(target=_self.discover, name='informix-discovery')
+        discovery.daemon = True
+        discovery.start()
+
+    def discover(_self):
+        # Retries with an exponential backoff until Informix answers, collections report node_ifx_up 0 until then
+        backoff = _self.discovery_backoff
+        while _self.running:
+            try:
+                if _self.check_connection():
+                    # Setting some normally never changing values
+                    if type(_self).ha_alias == "":
+                        records = _self.execute_sql("ha_alias")
+                        if len(records) == 1:
+                            _self.ha_alias = records[0]['ha_alias']
+                    if type(_self).dbhostname == "":
+                        records = _self.execute_sql("hostname")
+                        if len(records) == 1:
+                            _self.dbhostname = records[0]['hostname']
+                    records = _self.execute_sql("version")
+                    if len(records) == 1:
+                        _self.switch_version(records[0]['version'])
+                    _self.save_state()
+                    _self.discovered.set()
+                    _self.print_info("Connected to {0}".format(_self.dbhostname))
+                    return
+            except Exception, e:
+                _self.print_error("Looking up the instance failed: {0}".format(e))
+            finally:
+                _self.attempted.set()
+            _self.print_error("Informix is not reachable, trying again in {0} seconds".format(backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, _self.discovery_backoff_max)
+
+    def check_connection(_self):
+        # A pooled connection may have gone stale since it was last used, only a statement that runs tells
+        connection = _self.acquire_connection('ping')
+        if connection is not None and not _self.ping(connection):
+            _self.disconnect(connection)
+            connection = None
+        if connection is None:
+            connection = _self.connect()
+            if connection is not None and not _self.ping(connection):
+                _self.disconnect(connection)
+                connection = None
+        _self.release_connection(connection)
+        return connection is not None
+
+    def check_connection_in_time(_self, t0):
+        # Connecting can hang as long as the network lets it, with deadlines that counts against the scrape as well
+        if not _self.has_deadlines():
+            return _self.check_connection()
+        task = _self.new_task()
+        finished = Queue.Queue()
+        checker = threading.Thread(target=_self.run_check, args=(task, finished), name='informix-check')
+        checker.daemon = True
+        checker.start()
+        deadline = min([t0 + timeout for timeout in (_self.query_timeout, _self.scrape_timeout) if timeout > 0])
+        try:
+            return finished.get(timeout=max(deadline - time.time(), 0))
+        except Queue.Empty:
+            _self.print_error("Gave up waiting for the connection to Informix after {0:.1f} seconds".format(time.time() - t0))
+            _self.abandon_task(task)
+            return False
+
+    def run_check(_self, task, finished):
+        _self.current.task = task
+        try:
+            finished.put(_self.check_connection())
+        except Exception, e:
+            _self.print_error("Checking the connection failed: {0}".format(e))
+            finished.put(False)
+
+    def ping(_self, connection):
+        try:
+            IfxPy.free_result(_self.execute_prepared(connection, _self.ping_sql))
+            return True
+        except Exception, e:
+            _self.print_error("Informix didn't answer on the connection: {0}".format(e))
+            return False
+
+    def acquire_connection(_self, sql_name):
+        task = getattr(_self.current, 'task', None)
+        if task is not None and task['abandoned'].is_set():
+            raise Exception('Not running {0}, the collection gave up waiting for it'.format(sql_name))
+        if not _self.running:
+            raise Exception('Not running {0}, the collector is closed'.format(sql_name))
+        connection = _self.pool.acquire()
+        if not _self.running:
+            # close() went over the pool while we waited for it
+            if connection is not None:
+                _self.disconnect(connection)
+            _self.pool.release(None)
+            raise Exception('Not running {0}, the collector is closed'.format(sql_name))
+        if task is None:
+            return connection
+        with task['lock']:
+            if task['abandoned'].is_set():
+                # Given up on while we waited for the pool, nobody replaced this slot
+                _self.pool.release(connection)
+                raise Exception('Not running {0}, the collection gave up waiting for it'.format(sql_name))
+            task['holding'] += 1
+        return connection
+
+    def release_connection(_self, connection):
+        task = getattr(_self.current, 'task', None)
+        abandoned = False
+        if task is not None:
+            with task['lock']:
+                task['holding'] -= 1
+                abandoned = task['abandoned'].is_set()
+        if abandoned:
+            # The pool got a fresh slot in our place when we were abandoned
+            if connection is not None:
+                _self.disconnect(connection)
+            return
+        with _self.running_lock:
+            if _self.running:
+                _self.pool.release(connection)
+                return
+        # close() already went over the pool, the slot comes back but the connection doesn't
+        if connection is not None:
+            _self.disconnect(connection)
+        _self.pool.release(None)
+
+    def execute_prepared(_self, connection, sql, params=None):
+        # Only the first run on a connection makes the server parse and optimize the statement
+        with _self.connection_lock:
+            statements = _self.statements.setdefault(connection, {})
+        stat = statements.get(sql)
+        if stat is None:
+            stat = IfxPy.prepare(connection, sql)
+            statements[sql] = stat
+        if params is None:
+            IfxPy.execute(stat)
+        else:
+            IfxPy.execute(stat, params)
+        return stat
+
+    def get_sql(_self, sql_name):
         if sql_name not in _self.sql_matrix[_self.version].keys():
             raise Exception('{0} not in SQL Matrix for version {1} - bailing out.\n Please comment out the call using the sql statement in the collect() function.'.format(sql_name, _self.version))
-        sql = _self.sql_matrix[_self.version][sql_name]
+        return _self.sql_matrix[_self.version][sql_name]
+
+    def execute_statement(_self, connection, sql_name, sql, params=None):
+        # Returns the connection to hand back to the pool and the executed statement, or None when we can't connect
+        if connection is None:
+            connection = _self.connect()
         try:
-            stat = IfxPy.exec_immediate(_self.connection, sql)
+            stat = _self.execute_prepared(connection, sql, params)
         except Exception, e:
             _self.print_error("Could not execute SQL statement - are we connected? {0}".format(e))
-            _self.disconnect()
-            _self.connect()
-            if not _self.connection is None:
-                stat = IfxPy.exec_immediate(_self.connection, sql)
-        if not _self.connection is None:
-            res = IfxPy.fetch_assoc(stat)
-        else:
-            _self.print_error("Seems like we're not connected to the DB.")
-            return
+            _self.record_error(sql_name)
+            if not connection is None:
+                _self.disconnect(connection)
+            connection = _self.connect()
+            if connection is None:
+                return connection, None
+            _self.record_reconnect(sql_name)
+            try:
+                stat = _self.execute_prepared(connection, sql, params)
+            except Exception, e:
+                _self.print_error("SQL statement {0} failed after reconnecting: {1}".format(sql_name, e))
+                _self.record_error(sql_name)
+                _self.disconnect(connection)
+                return None, None
+        return connection, stat
+
+    def execute_sql(_self, sql_name):
+        sql = _self.get_sql(sql_name)
+        connection = _self.acquire_connection(sql_name)
+        t0 = time.time()
         records = []
-        while res:
-            row = {}
-            for key in res.keys():
-                row[key] = res[key]
-            records.append(row)
+        try:
+            connection, stat = _self.execute_statement(connection, sql_name, sql)
+            if stat is None:
+                # Raised, so nobody mistakes it for an empty result and caches that
+                raise NotConnected("Seems like we're not connected to the DB, {0} didn't run.".format(sql_name))
+            # fetch_assoc() hands out a new dict for every row, no need to copy it
             res = IfxPy.fetch_assoc(stat)
-        IfxPy.free_result(stat)
-        IfxPy.free_stmt (stat)
-        return records
-    
-    def get_uptime_and_mode_info(_self):
+            while res:
+                records.append(res)
+                res = IfxPy.fetch_assoc(stat)
+            # Only the result set, the statement stays prepared for the next run
+            IfxPy.free_result(stat)
+            return records
+        except NotConnected:
+            # Already counted by execute_statement()
+            raise
+        except Exception:
+            _self.record_error(sql_name)
+            raise
+        finally:
+            _self.record_query(sql_name, time.time() - t0, len(records))
+            _self.release_connection(connection)
+
+    def fetch_rows(_self, sql_name, columns, params=None):
+        # Yields the rows of a statement as tuples holding the given columns in the given order.
+        # When that matches the select list, the tuples from fetch_tuple() are handed out as is.
+        # params fill in the ? placeholders of the statement.
+        sql = _self.get_sql(sql_name)
+        connection = _self.acquire_connection(sql_name)
+        t0 = time.time()
+        rows = 0
+        # While a row is handed out the clock is with the caller, that time doesn't count for the statement
+        paused = None
+        try:
+            connection, stat = _self.execute_statement(connection, sql_name, sql, params)
+            if stat is None:
+                # Raised, so nobody mistakes it for an empty result and caches that
+                raise NotConnected("Seems like we're not connected to the DB, {0} didn't run.".format(sql_name))
+            names = _self.columns.get(sql)
+            if names is None:
+                names = tuple(IfxPy.field_name(stat, position).lower() for position in range(IfxPy.num_fields(stat)))
+                _self.columns[sql] = names
+            missing = [column for column in columns if column not in names]
+            if missing:
+                raise Exception('{0} returns no column {1}, only {2}'.format(sql_name, ', '.join(missing), ', '.join(names)))
+            positions = tuple(names.index(column) for column in columns)
+            fetch = IfxPy.fetch_tuple
+            if positions == tuple(range(len(names))):
+                row = fetch(stat)
+                while row:
+                    rows += 1
+                    paused = time.time()
+                    yield row
+                    t0 += time.time() - paused
+                    paused = None
+                    row = fetch(stat)
+            else:
+                row = fetch(stat)
+                while row:
+                    rows += 1
+                    paused = time.time()
+                    yield tuple([row[position] for position in positions])
+                    t0 += time.time() - paused
+                    paused = None
+                    row = fetch(stat)
+            IfxPy.free_result(stat)
+        except GeneratorExit:
+            # The caller stopped reading early, the rest of the result set goes
+            IfxPy.free_result(stat)
+            raise
+        except NotConnected:
+            # Already counted by execute_statement()
+            raise
+        except Exception:
+            _self.record_error(sql_name)
+            raise
+        finally:
+            if paused is not None:
+                t0 += time.time() - paused
+            _self.record_query(sql_name, time.time() - t0, rows)
+            _self.release_connection(connection)
+
+    def get_query_stats(_self, sql_name):
+        stats = _self.query_stats.get(sql_name)
+        if stats is None:
+            stats = {'buckets': [0] * len(_self.duration_buckets), 'sum': 0.0, 'rows': 0, 'errors': 0, 'reconnects': 0, 'timeouts': 0}
+            _self.query_stats[sql_name] = stats
+        return stats
+
+    def record_query(_self, sql_name, duration, rows):
+        with _self.stats_lock:
+            stats = _self.get_query_stats(sql_name)
+            for position, bound in enumerate(_self.duration_buckets):
+                if duration <= bound:
+                    stats['buckets'][position] += 1
+                    break
+            stats['sum'] += duration
+            stats['rows'] += rows
+        if _self.slow_query_log > 0 and duration >= _self.slow_query_log:
+            _self.print_info("Slow SQL statement {0}: {1:.3f} seconds, {2} rows".format(sql_name, duration, rows))
+
+    def record_error(_self, sql_name):
+        with _self.stats_lock:
+            _self.get_query_stats(sql_name)['errors'] += 1
+
+    def record_reconnect(_self, sql_name):
+        with _self.stats_lock:
+            _self.get_query_stats(sql_name)['reconnects'] += 1
+
+    def record_timeout(_self, sql_name):
+        with _self.stats_lock:
+            _self.get_query_stats(sql_name)['timeouts'] += 1
+
+    def get_query_stats_info(_self):
+        duration = HistogramMetricFamily('node_ifx_query_duration_seconds', 'Time spent running a sql statement and fetching its rows', labels=["ifxserver", "query"])
+        rows = CounterMetricFamily('node_ifx_query_rows', 'Rows fetched per sql statement', labels=["ifxserver", "query"])
+        errors = CounterMetricFamily('node_ifx_query_errors', 'Failed executions per sql statement', labels=["ifxserver", "query"])
+        reconnects = CounterMetricFamily('node_ifx_query_reconnects', 'Reconnects caused by a failing sql statement', labels=["ifxserver", "query"])
+        timeouts = CounterMetricFamily('node_ifx_query_timeouts', 'Collections that gave up waiting for a sql statement', labels=["ifxserver", "query"])
+        with _self.stats_lock:
+            for sql_name in sorted(_self.query_stats.keys()):
+                stats = _self.query_stats[sql_name]
+                labels = [_self.dbhostname, sql_name]
+                buckets = []
+                count = 0
+                for bound, observations in zip(_self.duration_buckets, stats['buckets']):
+                    count += observations
+                    buckets.append(('+Inf' if bound == float('inf') else str(bound), count))
+                duration.add_metric(labels, buckets, stats['sum'])
+                rows.add_metric(labels, stats['rows'])
+                errors.add_metric(labels, stats['errors'])
+                reconnects.add_metric(labels, stats['reconnects'])
+                timeouts.add_metric(labels, stats['timeouts'])
+        return [duration, rows, errors, reconnects, timeouts]
+
+    def get_uptime_and_mode_info(_self, record=None):
         ifx_modes = {-1: 'Offline',
                       0: 'Initialisation',
                       1: 'Quiescent',
@@ -211,24 +933,34 @@ class InformixCollector(object):
                       6: 'Abort'}
         uptime_gauge = GaugeMetricFamily('node_ifx_uptime', 'Uptime reported by informix', labels=["ifxserver"])
         ifx_mode = GaugeMetricFamily('node_ifx_mode', 'Informix current mode', labels=["ifxserver", "mode"])
-        records = _self.execute_sql('uptime_mode')
-        uptime_gauge.add_metric([_self.dbhostname], str(records[0]['online']))
-        ifx_mode.add_metric([_self.dbhostname, ifx_modes[records[0]['mode']]], records[0]['mode'])
+        if record is None:
+            record = _self.execute_sql('uptime_mode')[0]
+        uptime_gauge.add_metric([_self.dbhostname], record['online'])
+        ifx_mode.add_metric([_self.dbhostname, ifx_modes[record['mode']]], record['mode'])
         return [uptime_gauge, ifx_mode]
 
     def get_max_license_memory_from_version(_self, version):
-        matches = re.findall("^[0-9]*", version)
-        if len(matches) != 1:
+        major = _self.switch_version(version)
+        if major is None:
             # We didn't find the version, return 1GB
             return 1<<30
+        edition = version[-2:]
+        return _self.memory_matrix[major][edition]
+
+    def switch_version(_self, version):
+        # Returns the major version in a version string, and uses its sql from now on
+        matches = re.findall("^[0-9]+", version)
+        if len(matches) != 1:
+            return None
         major = int(matches[0])
         # If we were started with the wrong version or upgraded in the mean time
-        if _self.version != major:
+        if _self.version != major and major in _self.sql_matrix.keys():
+            # Nothing to reset: statements are prepared per sql text, the new version's sql gets prepared
+            # on first use and what the old one prepared is freed with its connection
             _self.version = major
-        edition = version[-2:]
-        return _self.memory_matrix[major][edition]
+        return major
 
-    def get_memory_and_version_info(_self):
+    def get_version_info(_self):
         metrics = []
         records = _self.execute_sql('version')
         if len(records) == 1:
@@ -238,26 +970,50 @@ class InformixCollector(object):
             max_memory = GaugeMetricFamily('node_ifx_max_memory_allowed', 'Informix maximum allowed memory', labels=["ifxserver"])
             max_memory.add_metric([_self.dbhostname], _self.get_max_license_memory_from_version(records[0]['version']))
             metrics.append(max_memory)
-        records = _self.execute_sql('memory')
-        memory_used = GaugeMetricFamily('node_ifx_memory_used', 'Informix memory in use', labels=["ifxserver"])
-        memory_used.add_metric([_self.dbhostname], records[0]['total_size'])
-        metrics.append(memory_used)
         return metrics
 
+    def get_memory_info(_self, record=None):
+        if record is None:
+            record = _self.execute_sql('memory')[0]
+        memory_used = GaugeMetricFamily('node_ifx_memory_used', 'Informix memory in use', labels=["ifxserver"])
+        memory_used.add_metric([_self.dbhostname], record['total_size'])
+        return memory_used
+
     def get_session_info(_self):
         sessions = GaugeMetricFamily('node_ifx_sessions', 'Informix sessions', labels=['ifxserver', 'host', 'user'])
-        records = _self.execute_sql('sessions')
-        for record in records:
-            if record['host'] == '':
-                sessions.add_metric([_self.dbhostname, "SHMEM", record['user']], record['count'])
+        kept = 0
+        counted = 0
+        for user, host, count in _self.fetch_rows('sessions_top' if _self.max_series > 0 else 'sessions', ('user', 'host', 'count')):
+            if host == '':
+                sessions.add_metric([_self.dbhostname, "SHMEM", user], count)
             else:
-                sessions.add_metric([_self.dbhostname, record['host'], record['user']], record['count'])
+                sessions.add_metric([_self.dbhostname, host, user], count)
+            kept += 1
+            counted += float(count)
+        if _self.max_series > 0:
+            _self.add_other_series(sessions, 'sessions_total', kept, counted, [_self.dbhostname, "other", "other"])
         return sessions
 
-    def get_config_changes(_self):
+    def add_other_series(_self, family, sql_name, kept, counted, labels):
+        # Everything that didn't make it into the top rows ends up in one 'other' series
+        for total, series in _self.fetch_rows(sql_name, ('total', 'series')):
+            if series > kept:
+                family.add_metric(labels, float(total or 0) - counted)
+            with _self.stats_lock:
+                _self.dropped_series[family.name] = max(series - kept, 0)
+
+    def get_cardinality_info(_self):
+        dropped = GaugeMetricFamily('node_ifx_series_dropped', 'Series folded into the other series by the last collection because of --max-series', labels=["ifxserver", "metric"])
+        with _self.stats_lock:
+            for name in sorted(_self.dropped_series.keys()):
+                dropped.add_metric([_self.dbhostname, name], _self.dropped_series[name])
+        return dropped
+
+    def get_config_changes(_self, record=None):
         config_changes = GaugeMetricFamily('node_ifx_config_changes', 'The number of config changes since startup', labels=["ifxserver"])
-        records = _self.execute_sql('config_changes')
-        config_changes.add_metric([_self.dbhostname], str(records[0]['count']))
+        if record is None:
+            record = _self.execute_sql('config_changes')[0]
+        config_changes.add_metric([_self.dbhostname], record['count'])
         return config_changes
 
     def get_dbspaces_info(_self):
@@ -265,58 +1021,58 @@ class InformixCollector(object):
         # The pagesize reported by Informix is used elsewhere
         dbspaces_free = GaugeMetricFamily('node_ifx_dbspaces_free_size', 'Free space in dbspaces in bytes', labels=["ifxserver", "dbspace"])
         dbspaces_size = GaugeMetricFamily('node_ifx_dbspaces_size', 'Size of dbspaces in bytes', labels=["ifxserver", "dbspace"])
-        records = _self.execute_sql('dbspace_sizes')
-        for record in records:
-            dbspaces_free.add_metric([_self.dbhostname,record['name']], str(record['free']))
-            dbspaces_size.add_metric([_self.dbhostname,record['name']], str(record['size']))
+        for name, size, free in _self.fetch_rows('dbspace_sizes', ('name', 'size', 'free')):
+            dbspaces_free.add_metric([_self.dbhostname, name], free)
+            dbspaces_size.add_metric([_self.dbhostname, name], size)
         return [dbspaces_free, dbspaces_size]
 
     def get_sysprofile_info(_self):
-        records = _self.execute_sql('sysprofile')
         sysprofiles = []
-        for record in records:
-            sysprofile_info = CounterMetricFamily('node_ifx_sysprofile_{0}'.format(record['name']), 'Sysprofile value for {0}'.format(record['name']), labels=["ifxserver"])
-            sysprofile_info.add_metric([_self.dbhostname], str(record['value']))
+        for name, value in _self.fetch_rows('sysprofile', ('name', 'value')):
+            sysprofile_info = CounterMetricFamily('node_ifx_sysprofile_{0}'.format(name), 'Sysprofile value for {0}'.format(name), labels=["ifxserver"])
+            sysprofile_info.add_metric([_self.dbhostname], value)
             sysprofiles.append(sysprofile_info)
         return sysprofiles
 
     def get_vpu_class_info(_self):
-        records = _self.execute_sql('vpu_class')
+        counters = ('usecs_user', 'usecs_sys', 'readyqueue', 'num_ready', 'idle', 'semops', 'busy_waits', 'spins')
         vpu_classes = []
-        for record in records:
-            class_info = CounterMetricFamily('node_ifx_vpu_class_{0}'.format(record['classname']), 'VPU info value for class {0}'.format(record['classname']), labels=["ifxserver", "class", "metric"])
-            class_info.add_metric([_self.dbhostname, record['classname'], 'usecs_user'], str(record['usecs_user']))
-            class_info.add_metric([_self.dbhostname, record['classname'], 'usecs_sys'], str(record['usecs_sys']))
-            class_info.add_metric([_self.dbhostname, record['classname'], 'readyqueue'], str(record['readyqueue']))
-            class_info.add_metric([_self.dbhostname, record['classname'], 'num_ready'], str(record['num_ready']))
-            class_info.add_metric([_self.dbhostname, record['classname'], 'idle'], str(record['idle']))
-            class_info.add_metric([_self.dbhostname, record['classname'], 'semops'], str(record['semops']))
-            class_info.add_metric([_self.dbhostname, record['classname'], 'busy_waits'], str(record['busy_waits']))
-            class_info.add_metric([_self.dbhostname, record['classname'], 'spins'], str(record['spins']))
+        for row in _self.fetch_rows('vpu_class', ('classname',) + counters):
+            classname = row[0]
+            class_info = CounterMetricFamily('node_ifx_vpu_class_{0}'.format(classname), 'VPU info value for class {0}'.format(classname), labels=["ifxserver", "class", "metric"])
+            for position, counter in enumerate(counters, 1):
+                class_info.add_metric([_self.dbhostname, classname, counter], row[position])
             vpu_classes.append(class_info)
         return vpu_classes
 
-    def get_open_transaction_info(_self):
-        record = _self.execute_sql('open_transactions')[0]
+    def get_open_transaction_info(_self, record=None):
+        if record is None:
+            record = _self.execute_sql('open_transactions')[0]
         open_transactions = CounterMetricFamily('node_ifx_open_transactions', "Informix transaction info", labels=["ifxserver"])
-        open_transactions.add_metric([_self.dbhostname], str(record['open_transactions']))
+        open_transactions.add_metric([_self.dbhostname], record['open_transactions'])
         return open_transactions
 
     def get_locks_per_user(_self):
-        records = _self.execute_sql('locks_per_user')
         locks = GaugeMetricFamily('node_ifx_locks_user_db', 'Locks per user', labels=["ifxserver", "user"])
-        for record in records:
-            locks.add_metric([_self.dbhostname, record['username'], ], record['locks'])
-        if len(records) == 0:
+        kept = 0
+        counted = 0
+        for username, count in _self.fetch_rows('locks_per_user_top' if _self.max_series > 0 else 'locks_per_user', ('username', 'locks')):
+            locks.add_metric([_self.dbhostname, username], count)
+            kept += 1
+            counted += float(count)
+        if _self.max_series > 0:
+            _self.add_other_series(locks, 'locks_per_user_total', kept, counted, [_self.dbhostname, "other"])
+        if len(locks.samples) == 0:
             # We didn't have any locks - yay!
             # But we still want to report something, so doing it manually
             locks.add_metric([_self.dbhostname, "informix", "sysmaster"], 0)
         return locks
 
-    def get_mutex_info(_self):
-        record = _self.execute_sql('mutexes')[0]
+    def get_mutex_info(_self, record=None):
+        if record is None:
+            record = _self.execute_sql('mutexes')[0]
         mutex = CounterMetricFamily('node_ifx_mutex', "Informix mutex count", labels=["ifxserver"])
-        mutex.add_metric([_self.dbhostname], str(record['mutex_count']))
+        mutex.add_metric([_self.dbhostname], record['mutex_count'])
         return mutex
 
     def get_thread_info(_self):
@@ -329,13 +1085,11 @@ class InformixCollector(object):
                   5: 'Terminated',
                   6: '6-unknown',
                   7: 'Sleeping'}
-        records = _self.execute_sql('threads')
-        for record in records:
-            thread_states.add_metric([_self.dbhostname, record['classname'], states[record['threadstate']]], record['count'])
+        for classname, threadstate, count in _self.fetch_rows('threads', ('classname', 'threadstate', 'count')):
+            thread_states.add_metric([_self.dbhostname, classname, states[threadstate]], count)
         return thread_states
 
     def get_buffer_info(_self):
-        records = _self.execute_sql('buffers')
         metrics = {}
         counters = ['dskreads','pagreads','bufreads','dskwrites','pagwrites','bufwrites','bufwaits','ovbuff','flushes','fgwrites','lruwrites','chunkwrites','lru_time_total','lru_calls', 'buffer_turnovers']
         for key in counters:
@@ -343,17 +1097,137 @@ class InformixCollector(object):
         gauges = ['size']
         for key in gauges:
             metrics[key] = GaugeMetricFamily('node_ifx_bufferpool_{0}'.format(key), 'Buffer pool value for {0}'.format(key), labels=["ifxserver", "pagesize"])
-        for record in records:
-            for key in counters+gauges:
-                metrics[key].add_metric([_self.dbhostname, str(record['pagesize'])], str(record[key]))
+        keys = counters + gauges
+        families = [metrics[key] for key in keys]
+        for row in _self.fetch_rows('buffers', tuple(keys) + ('pagesize',)):
+            labels = [_self.dbhostname, str(row[-1])]
+            for position, family in enumerate(families):
+                family.add_metric(labels, row[position])
         return metrics
 
-    def get_slow_queries(_self):
-        record = _self.execute_sql('slow_queries')[0]
+    def get_slow_queries(_self, record=None):
+        if record is None:
+            record = _self.execute_sql('slow_queries')[0]
         slow_queries = GaugeMetricFamily('node_ifx_slowquery', 'Thread states of Informix threads', labels=["ifxserver"])
-        slow_queries.add_metric([_self.dbhostname], str(record['slow_queries']))
+        slow_queries.add_metric([_self.dbhostname], record['slow_queries'])
         return slow_queries
 
+    def get_scalar_info(_self):
+        # All single row statements in one go, handed to the functions that normally run them one by one
+        record = _self.execute_sql('scalars')[0]
+        metrics = []
+        for sql_name, function in InformixCollector.metric_matrix:
+            if sql_name in _self.scalar_matrix:
+                metrics.extend(_self.as_metric_list(getattr(_self, function)(record)))
+        return metrics
+
+    def get_sampled_info(_self):
+        # Tables like sysptprof have a row per partition, hundreds of thousands on big instances.
+        # Every collection reads at most sample_share rows of each, continuing where the previous one stopped,
+        # and the rows are merged into a view of the whole table that is exported.
+        if _self.sample_lock.acquire(False):
+            try:
+                for sql_name, sample in _self.sample_matrix:
+                    _self.read_shard(sql_name, sample, _self.sample_share)
+            finally:
+                _self.sample_lock.release()
+        else:
+            # An abandoned collection is still reading, export the view as it is
+            _self.print_info("Still reading the previous shard, exporting the sampled objects as they are")
+        return _self.get_sample_metrics()
+
+    def read_shard(_self, sql_name, sample, budget):
+        # Reads the next rows of a sample_matrix table, at most budget of them, and returns how many were read
+        state = _self.samples.get(sql_name)
+        if state is None:
+            state = {'after': -1, 'objects': {}, 'read_at': {}, 'heat': {}, 'seen': set(), 'totals': [0] * len(sample['values']),
+                     'pass_started': time.time(), 'pass_seconds': -1}
+            _self.samples[sql_name] = state
+        columns = (sample['key'],) + sample['labels'] + sample['values']
+        objects = state['objects']
+        totals = state['totals']
+        read_at = state['read_at']
+        heat = state['heat']
+        width = len(sample['labels']) + 1
+        ranks = [width + list(sample['values']).index(value) for value in sample['rank']]
+        with _self.stats_lock:
+            errors = _self.get_query_stats(sql_name)['errors']
+        rows = _self.fetch_rows(sql_name, columns, (state['after'],))
+        read = 0
+        finished = True
+        for row in rows:
+            now = time.time()
+            key = row[0]
+            previous = objects.get(key)
+            if previous is not None:
+                for position in range(len(totals)):
+                    totals[position] -= previous[width + position] or 0
+                # How busy it is now: the rank I/O per second since we saw it last pass
+                change = sum([(row[position] or 0) - (previous[position] or 0) for position in ranks])
+                if change > 0 and now > read_at[key]:
+                    heat[key] = change / (now - read_at[key])
+                else:
+                    heat.pop(key, None)
+            for position in range(len(totals)):
+                totals[position] += row[width + position] or 0
+            objects[key] = row
+            read_at[key] = now
+            state['seen'].add(key)
+            state['after'] = key
+            read += 1
+            if read >= budget:
+                finished = False
+                break
+        rows.close()
+        with _self.stats_lock:
+            failed = _self.get_query_stats(sql_name)['errors'] != errors
+        if read == 0 and failed:
+            # Nothing came back because the statement failed, not because the table is done
+            return read
+        if finished:
+            # Whole table done: objects that weren't there anymore are dropped, the next pass starts over
+            for gone in [candidate for candidate in objects if candidate not in state['seen']]:
+                for position in range(len(totals)):
+                    totals[position] -= objects[gone][width + position] or 0
+                del objects[gone]
+                del read_at[gone]
+                heat.pop(gone, None)
+            now = time.time()
+            state['after'] = -1
+            state['seen'] = set()
+            state['pass_seconds'] = now - state['pass_started']
+            state['pass_started'] = now
+        return read
+
+    def get_sample_metrics(_self):
+        metrics = []
+        objects_count = GaugeMetricFamily('node_ifx_sample_objects', 'Objects in the merged view of a sampled table', labels=["ifxserver", "query"])
+        pass_seconds = GaugeMetricFamily('node_ifx_sample_pass_seconds', 'Seconds the last complete pass over a sampled table took, -1 before the first one', labels=["ifxserver", "query"])
+        for sql_name, sample in _self.sample_matrix:
+            state = _self.samples.get(sql_name)
+            if state is None:
+                continue
+            width = len(sample['labels']) + 1
+            labels = ["ifxserver"] + list(sample['names'])
+            # Copies, the next shard may be read while these are exported
+            objects = dict(state['objects'])
+            heat = dict(state['heat'])
+            totals = list(state['totals'])
+            # The busiest right now, not the biggest since the instance started. An object needs two passes to get a rate
+            top = [objects[key] for key in heapq.nlargest(_self.sample_top, heat.keys(), key=heat.get) if key in objects]
+            for position, value in enumerate(sample['values']):
+                family = CounterMetricFamily('node_ifx_{0}_{1}'.format(sample['prefix'], value), '{0} of the busiest {1} objects'.format(value, sample['help']), labels=labels)
+                for row in top:
+                    family.add_metric([_self.dbhostname] + [str(label) for label in row[:width]], row[width + position])
+                metrics.append(family)
+                # Not a counter, it goes down when objects are dropped
+                total = GaugeMetricFamily('node_ifx_{0}s_{1}'.format(sample['prefix'], value), '{0} of all {1} objects, as far as they were sampled'.format(value, sample['help']), labels=["ifxserver"])
+                total.add_metric([_self.dbhostname], totals[position])
+                metrics.append(total)
+            objects_count.add_metric([_self.dbhostname, sql_name], len(objects))
+            pass_seconds.add_metric([_self.dbhostname, sql_name], state['pass_seconds'])
+        return metrics + [objects_count, pass_seconds]
+
     def get_rss_info(_self):
         records = _self.execute_sql('rss_role')
         if len(records) < 1:
@@ -381,57 +1255,587 @@ class InformixCollector(object):
                 metrics.append(replication_lag)
         return metrics
     
-    def collect(_self):
+    def gather(_self):
         t0 = time.time()
-        if _self.connection is None:
-            _self.connect()
-        else:
-            # Single metric functions
-            yield _self.get_config_changes()
-            yield _self.get_locks_per_user()
-            yield _self.get_mutex_info()
-            yield _self.get_open_transaction_info()
-            yield _self.get_slow_queries()
-            yield _self.get_session_info()
-            yield _self.get_thread_info()
-            # Multi-metric functions
-            for res in _self.get_buffer_info().values():
-                yield res
-            for res in _self.get_dbspaces_info():
-                yield res
-            for res in _self.get_memory_and_version_info():
-                yield res
-            for res in _self.get_rss_info():
-                yield res
-            for res in _self.get_sysprofile_info():
-                yield res
-            for res in _self.get_uptime_and_mode_info():
-                yield res
-            for res in _self.get_vpu_class_info():
-                yield res
+        # Right after startup the first discovery attempt is usually about to succeed. If it hangs, say
+        # on a host that drops our packets, the scrape reports node_ifx_up 0 instead of hanging with it
+        _self.attempted.wait(_self.discovery_wait)
+        connected = _self.discovered.is_set() and _self.check_connection_in_time(t0)
+        if connected:
+            if _self.has_deadlines():
+                results = _self.gather_with_deadlines(t0)
+            elif _self.workers is None:
+                results = [_self.get_entry_metrics(sql_name, function) for sql_name, function in _self.metric_matrix]
+            else:
+                # map() hands the results back in metric_matrix order, whatever order the queries finish in
+                results = _self.workers.map(lambda entry: _self.get_entry_metrics(entry[0], entry[1]), _self.metric_matrix)
+            for metrics in results:
+                for res in metrics:
+                    yield res
         t1 = time.time()
         execution_time = GaugeMetricFamily('node_ifx_execution_time', 'Time it took to gather statistics', labels=["ifxserver"])
         delta = t1-t0
-        if _self.connection is None:
+        if not connected:
             # If we don't have a valid connection, we'll send the execution time as negative value to signal something is wrong
             execution_time.add_metric([_self.dbhostname], delta*-1)
         else:
             execution_time.add_metric([_self.dbhostname], delta)
         yield execution_time
+        up = GaugeMetricFamily('node_ifx_up', 'Whether the last collection could run a statement on Informix', labels=["ifxserver"])
+        up.add_metric([_self.dbhostname], 1 if connected else 0)
+        yield up
+        for res in _self.get_query_stats_info():
+            yield res
+        if _self.watch_interval > 0:
+            for res in _self.get_watch_info():
+                yield res
+        if _self.has_deadlines():
+            for res in _self.get_query_status_info():
+                yield res
+        if _self.max_series > 0:
+            yield _self.get_cardinality_info()
         _self.print_info("Finished run in {0} seconds".format(delta))
 
+    def has_deadlines(_self):
+        return _self.query_timeout > 0 or _self.scrape_timeout > 0
+
+    def gather_with_deadlines(_self, t0):
+        # Every entry runs in its own thread, at most pool_size at a time, so one that hangs can be left behind.
+        # IfxPy can't cancel a running statement: an entry past its deadline is abandoned, its connection is
+        # replaced in the pool and closed as soon as the statement returns.
+        results = [[] for entry in _self.metric_matrix]
+        status = {}
+        pending = list(enumerate(_self.metric_matrix))
+        running = {}
+        finished = Queue.Queue()
+        scrape_deadline = t0 + _self.scrape_timeout if _self.scrape_timeout > 0 else None
+        while pending or running:
+            now = time.time()
+            while pending and len(running) < _self.pool_size and (scrape_deadline is None or now < scrape_deadline):
+                position, (sql_name, function) = pending.pop(0)
+                if _self.breaker_is_open(sql_name, now):
+                    status[sql_name] = 'skipped'
+                    continue
+                outcome = _self.new_task()
+                worker = threading.Thread(target=_self.run_entry, args=(position, sql_name, function, outcome, finished), name='informix-query-{0}'.format(sql_name))
+                worker.daemon = True
+                worker.start()
+                running[position] = (sql_name, now, outcome)
+            if not running:
+                # Out of time before these could even start
+                for position, (sql_name, function) in pending:
+                    status[sql_name] = 'timeout'
+                    _self.record_timeout(sql_name)
+                break
+            deadlines = [entry_started + _self.query_timeout for entry_name, entry_started, entry_outcome in running.values() if _self.query_timeout > 0]
+            if scrape_deadline is not None:
+                deadlines.append(scrape_deadline)
+            try:
+                position = finished.get(timeout=max(min(deadlines) - time.time(), 0) if deadlines else None)
+                if position in running:
+                    sql_name, started, outcome = running.pop(position)
+                    if 'error' in outcome:
+                        _self.print_error("Collecting {0} failed: {1}".format(sql_name, outcome['error']))
+                        status[sql_name] = 'error'
+                    else:
+                        results[position] = outcome['metrics']
+                        status[sql_name] = 'ok'
+                    _self.breakers.pop(sql_name, None)
+            except Queue.Empty:
+                pass
+            now = time.time()
+            for position, (sql_name, started, outcome) in running.items():
+                if (_self.query_timeout > 0 and now >= started + _self.query_timeout) or (scrape_deadline is not None and now >= scrape_deadline):
+                    _self.print_error("Gave up waiting for {0} after {1:.1f} seconds".format(sql_name, now - started))
+                    _self.abandon_task(outcome)
+                    del running[position]
+                    status[sql_name] = 'timeout'
+                    _self.record_timeout(sql_name)
+                    _self.trip_breaker(sql_name, now)
+        _self.query_status = status
+        return results
+
+    def new_task(_self):
+        # abandoned tells the thread nobody waits for it anymore, holding counts the pool connections it has
+        return {'abandoned': threading.Event(), 'lock': threading.Lock(), 'holding': 0}
+
+    def abandon_task(_self, task):
+        # Only connections the task holds get a fresh slot, one it's still waiting for stays in the pool
+        with task['lock']:
+            task['abandoned'].set()
+            for held in range(task['holding']):
+                _self.pool.abandon()
+
+    def run_entry(_self, position, sql_name, function, outcome, finished):
+        _self.current.task = outcome
+        try:
+            outcome['metrics'] = _self.get_cached_metrics(sql_name, function)
+        except Exception, e:
+            outcome['error'] = e
+        finished.put(position)
+
+    def breaker_is_open(_self, sql_name, now):
+        breaker = _self.breakers.get(sql_name)
+        return breaker is not None and breaker[1] > now
+
+    def trip_breaker(_self, sql_name, now):
+        breaker = _self.breakers.setdefault(sql_name, [0, 0])
+        breaker[0] += 1
+        if breaker[0] >= _self.breaker_threshold:
+            # After the cool-down it gets one try, timing out again opens the breaker right away
+            breaker[1] = now + _self.breaker_cooldown
+            _self.print_error("{0} timed out {1} times in a row, skipping it for {2} seconds".format(sql_name, breaker[0], _self.breaker_cooldown))
+
+    def get_query_status_info(_self):
+        query_up = GaugeMetricFamily('node_ifx_query_up', 'Whether a collected sql statement returned in time during the last collection', labels=["ifxserver", "query"])
+        query_skipped = GaugeMetricFamily('node_ifx_query_skipped', 'Whether a sql statement is skipped because it kept timing out', labels=["ifxserver", "query"])
+        now = time.time()
+        for sql_name, function in _self.metric_matrix:
+            query_up.add_metric([_self.dbhostname, sql_name], 1 if _self.query_status.get(sql_name) == 'ok' else 0)
+            query_skipped.add_metric([_self.dbhostname, sql_name], 1 if _self.breaker_is_open(sql_name, now) else 0)
+        return [query_up, query_skipped]
+
+    def start_watcher(_self):
+        watcher = threading.Thread(target=_self.watch, name='informix-watcher')
+        watcher.daemon = True
+        watcher.start()
+
+    def watch(_self):
+        # Runs the watch_matrix statements every watch_interval seconds, so spikes between two scrapes aren't lost
+        previous = {}
+        while _self.running:
+            t0 = time.time()
+            if _self.discovered.is_set():
+                for sql_name, watch in _self.watch_matrix:
+                    try:
+                        _self.watch_once(sql_name, watch, previous)
+                    except Exception, e:
+                        _self.print_error("Watching {0} failed: {1}".format(sql_name, e))
+            time.sleep(max(_self.watch_interval - (time.time() - t0), 0))
+
+    def watch_once(_self, sql_name, watch, previous):
+        width = len(watch['labels'])
+        for row in _self.fetch_rows(sql_name, watch['labels'] + watch['values']):
+            now = time.time()
+            key = ','.join([str(label) for label in row[:width]])
+            for position, column in enumerate(watch['values'], width):
+                if row[position] is None:
+                    continue
+                name = (sql_name, key, column)
+                value = float(row[position])
+                if watch['counter']:
+                    last = previous.get(name)
+                    previous[name] = (now, value)
+                    if last is None or now <= last[0] or value < last[1]:
+                        # First sample or a counter reset, no rate yet
+                        continue
+                    value = (value - last[1]) / (now - last[0])
+                with _self.watch_lock:
+                    ring = _self.watches.get(name)
+                    if ring is None:
+                        ring = RingBuffer(_self.watch_samples)
+                        _self.watches[name] = ring
+                    ring.append(now, value)
+
+    def get_watch_info(_self):
+        rates = GaugeMetricFamily('node_ifx_watch_rate', 'Per second rate of a watched counter over the watch window, quantile 1 is the peak', labels=["ifxserver", "query", "name", "column", "quantile"])
+        values = GaugeMetricFamily('node_ifx_watch_value', 'Watched value over the watch window, quantile 0 is the minimum and 1 the maximum', labels=["ifxserver", "query", "name", "column", "quantile"])
+        samples = GaugeMetricFamily('node_ifx_watch_samples', 'Samples behind the watched values', labels=["ifxserver", "query"])
+        covered = GaugeMetricFamily('node_ifx_watch_window_seconds', 'Seconds the summarized samples cover, less than the watch window when the ring buffers are too small for it', labels=["ifxserver", "query"])
+        counters = dict((sql_name, watch['counter']) for sql_name, watch in _self.watch_matrix)
+        now = time.time()
+        with _self.watch_lock:
+            windows = [(name, _self.watches[name].since(now - _self.watch_window)) for name in sorted(_self.watches.keys())]
+        counted = {}
+        seconds = {}
+        for (sql_name, key, column), (ring_values, oldest) in windows:
+            counted[sql_name] = max(counted.get(sql_name, 0), len(ring_values))
+            if len(ring_values) == 0:
+                continue
+            seconds[sql_name] = max(seconds.get(sql_name, 0), now - oldest)
+            ring_values.sort()
+            family = rates if counters.get(sql_name) else values
+            for quantile in _self.watch_quantiles:
+                family.add_metric([_self.dbhostname, sql_name, key, column, str(quantile)], ring_values[int(quantile * (len(ring_values) - 1))])
+        for sql_name, watch in _self.watch_matrix:
+            samples.add_metric([_self.dbhostname, sql_name], counted.get(sql_name, 0))
+            covered.add_metric([_self.dbhostname, sql_name], seconds.get(sql_name, 0))
+        return [rates, values, samples, covered]
+
+    def as_metric_list(_self, metrics):
+        if isinstance(metrics, dict):
+            return [metrics[key] for key in sorted(metrics.keys())]
+        elif not isinstance(metrics, list):
+            return [metrics]
+        return metrics
+
+    def get_entry_metrics(_self, sql_name, function):
+        # A broken entry, like a query file mapping a column its statement doesn't return, only loses its own metrics
+        try:
+            return _self.get_cached_metrics(sql_name, function)
+        except Exception, e:
+            _self.print_error("Collecting {0} failed: {1}".format(sql_name, e))
+            return []
+
+    def get_cached_metrics(_self, sql_name, function):
+        now = time.time()
+        cached = _self.metric_cache.get(sql_name)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        if not callable(function):
+            function = getattr(_self, function)
+        metrics = _self.as_metric_list(function())
+        refresh = _self.refresh_matrix.get(sql_name, 0)
+        if refresh > 0:
+            _self.metric_cache[sql_name] = (now + refresh, metrics)
+        return metrics
+
+    def start_poller(_self):
+        poller = threading.Thread(target=_self.poll, name='informix-poller')
+        poller.daemon = True
+        poller.start()
+
+    def poll(_self):
+        # Refresh the snapshot in the background so a scrape never waits on sysmaster
+        while _self.running:
+            t0 = time.time()
+            try:
+                metrics = _self.gather_shared()
+                with _self.snapshot_lock:
+                    _self.snapshot = metrics
+                    _self.snapshot_time = time.time()
+            except Exception, e:
+                _self.print_error("Background collection failed, keeping the previous snapshot")
+                _self.print_error(e)
+            time.sleep(max(_self.interval - (time.time() - t0), 0))
+
+    def gather_shared(_self):
+        # Only one collection runs at a time, whoever asks while it is in progress gets its result
+        with _self.flight_lock:
+            flight = _self.flight
+            leader = flight is None
+            if leader:
+                flight = {'done': threading.Event(), 'metrics': None, 'error': None}
+                _self.flight = flight
+        if leader:
+            try:
+                flight['metrics'] = list(_self.gather())
+            except Exception, e:
+                flight['error'] = e
+            finally:
+                with _self.flight_lock:
+                    _self.flight = None
+                flight['done'].set()
+        else:
+            flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        return flight['metrics']
+
+    def collect(_self):
+        if _self.interval <= 0:
+            for res in _self.gather_shared():
+                yield res
+            return
+        with _self.snapshot_lock:
+            metrics = _self.snapshot
+            snapshot_time = _self.snapshot_time
+        if metrics is not None:
+            for res in metrics:
+                yield res
+        snapshot_age = GaugeMetricFamily('node_ifx_snapshot_age', 'Seconds since the last completed background collection, -1 if there is none yet', labels=["ifxserver"])
+        if snapshot_time is None:
+            snapshot_age.add_metric([_self.dbhostname], -1)
+        else:
+            snapshot_age.add_metric([_self.dbhostname], time.time() - snapshot_time)
+        yield snapshot_age
+
+
+class ProbeManager(object):
+
+    # {name: {'database': ..., 'hostname': ..., 'port': ..., 'user': ..., 'password': ...}}
+    targets = None
+    # {name: {'collector': ..., 'cache': ..., 'last_used': ..., 'active': ...}}
+    collectors = None
+    lock = None
+    # {name: Lock}, held while the collector of a target is created so two first probes don't both connect
+    target_locks = None
+    probes = None
+    # Seconds a target may go unprobed before its collector and connections are closed
+    idle_timeout = 300
+    sqlhostsfile = "/tmp/sqlhosts.probe"
+    collector_options = None
+
+    # Seconds a rendered probe result is served to other scrapers of the same target
+    cache_ttl = 0
+
+    def __init__(_self, path, max_probes=10, idle_timeout=300, cache_ttl=0, **collector_options):
+        _self.targets = _self.load_targets(path)
+        _self.cache_ttl = cache_ttl
+        _self.collectors = {}
+        _self.lock = threading.Lock()
+        _self.target_locks = dict([(name, threading.Lock()) for name in _self.targets])
+        _self.probes = threading.BoundedSemaphore(max_probes)
+        _self.idle_timeout = idle_timeout
+        _self.collector_options = collector_options
+        _self.write_sqlhosts_file()
+        reaper = threading.Thread(target=_self.reap, name='informix-probe-reaper')
+        reaper.daemon = True
+        reaper.start()
+
+    def print_info(_self, message):
+        print "[II] {0} - {1}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), message)
+
+    def print_error(_self, message):
+        print "[EE] {0} - {1}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S"), message)
+
+    def load_targets(_self, path):
+        config = load_config_file(path)
+        defaults = config.get('defaults', {})
+        targets = {}
+        for name, options in config['targets'].items():
+            target = dict(defaults)
+            target.update(options or {})
+            target.setdefault('database', name)
+            for option in ['hostname', 'port', 'user', 'password']:
+                if option not in target:
+                    raise Exception('Target {0} has no {1} - bailing out.'.format(name, option))
+            targets[name] = target
+        return targets
+
+    def write_sqlhosts_file(_self):
+        # INFORMIXSQLHOSTS is process wide, so every target has to be in the same file
+        try:
+            lines = ["{0} {1} {2} {3}\n".format(target['database'], 'onsoctcp', target['hostname'], target['port']) for name, target in sorted(_self.targets.items())]
+            write_if_changed(_self.sqlhostsfile, ''.join(lines))
+        except Exception, e:
+            _self.print_error("Could not write sqlhosts file to {0}".format(_self.sqlhostsfile))
+            _self.print_error(e)
+            sys.exit(1)
+
+    def get_collector(_self, name):
+        # Connecting can take a while, only other probes of the same target wait for it
+        with _self.target_locks[name]:
+            with _self.lock:
+                entry = _self.collectors.get(name)
+                if entry is not None:
+                    entry['active'] += 1
+                    return entry
+            target = _self.targets[name]
+            collector = InformixCollector(database=target['database'], hostname=target['hostname'], port=target['port'], user=target['user'], password=target['password'], sqlhostsfile=_self.sqlhostsfile, **_self.collector_options)
+            registry = CollectorRegistry(auto_describe=False)
+            registry.register(collector)
+            with _self.lock:
+                entry = {'collector': collector, 'cache': ExpositionCache(registry, _self.cache_ttl), 'last_used': time.time(), 'active': 1}
+                _self.collectors[name] = entry
+            return entry
+
+    def probe(_self, name):
+        if name not in _self.targets:
+            return 404, "Unknown target '{0}'\n".format(name)
+        if not _self.probes.acquire(False):
+            return 503, "Too many concurrent probes\n"
+        try:
+            entry = _self.get_collector(name)
+            try:
+                return 200, entry['cache'].get()
+            finally:
+                with _self.lock:
+                    entry['active'] -= 1
+                    entry['last_used'] = time.time()
+        except Exception, e:
+            _self.print_error("Probe of {0} failed".format(name))
+            _self.print_error(e)
+            return 500, "Probe of {0} failed: {1}\n".format(name, e)
+        finally:
+            _self.probes.release()
+
+    def reap(_self):
+        while True:
+            time.sleep(max(_self.idle_timeout / 4.0, 1))
+            idle = []
+            with _self.lock:
+                now = time.time()
+                for name, entry in _self.collectors.items():
+                    if entry['active'] == 0 and now - entry['last_used'] > _self.idle_timeout:
+                        idle.append(entry['collector'])
+                        del _self.collectors[name]
+            for collector in idle:
+                collector.close()
+            if idle:
+                _self.print_info("Closed {0} idle target(s), {1} still cached".format(len(idle), len(_self.collectors)))
+
+
+class ExpositionCache(object):
+
+    registry = None
+    # Seconds a rendering is handed out before the registry is collected again, 0 renders every request
+    max_age = 0
+    lock = None
+    # (plain body, gzipped body, etag, rendered at)
+    exposition = None
+    # The rendering in progress that scrapers arriving meanwhile wait for: {'done': Event, 'exposition': ..., 'error': ...}
+    rendering = None
+
+    def __init__(_self, registry, max_age=0):
+        _self.registry = registry
+        _self.max_age = max_age
+        _self.lock = threading.Lock()
+
+    def get(_self):
+        # Scrapers arriving while a rendering is in progress take that one instead of starting their own
+        with _self.lock:
+            exposition = _self.exposition
+            if exposition is not None and time.time() - exposition[3] < _self.max_age:
+                return exposition
+            rendering = _self.rendering
+            leader = rendering is None
+            if leader:
+                rendering = {'done': threading.Event(), 'exposition': None, 'error': None}
+                _self.rendering = rendering
+        if leader:
+            # Not under the lock, so the others only wait for this rendering and nothing else
+            try:
+                rendering['exposition'] = _self.render()
+            except Exception, e:
+                rendering['error'] = e
+            finally:
+                with _self.lock:
+                    if rendering['exposition'] is not None:
+                        _self.exposition = rendering['exposition']
+                    _self.rendering = None
+                rendering['done'].set()
+        else:
+            rendering['done'].wait()
+        if rendering['error'] is not None:
+            raise rendering['error']
+        return rendering['exposition']
+
+    def render(_self):
+        body = generate_latest(_self.registry)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        gzipped = compressor.compress(body) + compressor.flush()
+        return (body, gzipped, '"{0}"'.format(hashlib.md5(body).hexdigest()), time.time())
+
+
+class ExporterHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Multi target mode
+    manager = None
+    # Single target mode, and the process metrics in multi target mode
+    cache = None
+
+    def do_GET(_self):
+        url = urlparse.urlparse(_self.path)
+        if url.path == '/probe' and _self.manager is not None:
+            target = urlparse.parse_qs(url.query).get('target', [''])[0]
+            status, output = _self.manager.probe(target)
+        elif url.path == '/metrics' or _self.manager is None:
+            # Like start_http_server(), a single target answers on any path
+            try:
+                status, output = 200, _self.cache.get()
+            except Exception, e:
+                # Like the prometheus_client handler did, instead of dropping the connection
+                status, output = 500, "Collecting the metrics failed: {0}\n".format(e)
+        else:
+            status, output = 404, "Use /probe?target=<name> or /metrics\n"
+        if status == 200:
+            _self.send_exposition(*output)
+            return
+        _self.send_response(status)
+        _self.send_header('Content-Type', 'text/plain')
+        _self.send_header('Content-Length', str(len(output)))
+        _self.end_headers()
+        _self.wfile.write(output)
+
+    def send_exposition(_self, body, gzipped, etag, rendered):
+        if 'gzip' in _self.headers.get('Accept-Encoding', ''):
+            body = gzipped
+            etag = etag[:-1] + '-gzip"'
+        else:
+            gzipped = None
+        if _self.is_not_modified(etag, rendered):
+            _self.send_response(304)
+            body = ''
+        else:
+            _self.send_response(200)
+            _self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+            _self.send_header('Content-Length', str(len(body)))
+            if gzipped is not None:
+                _self.send_header('Content-Encoding', 'gzip')
+        _self.send_header('Vary', 'Accept-Encoding')
+        _self.send_header('ETag', etag)
+        _self.send_header('Last-Modified', formatdate(rendered, usegmt=True))
+        _self.end_headers()
+        _self.wfile.write(body)
+
+    def is_not_modified(_self, etag, rendered):
+        if 'If-None-Match' in _self.headers:
+            return etag in [tag.strip() for tag in _self.headers['If-None-Match'].split(',')]
+        since = parsedate_tz(_self.headers.get('If-Modified-Since', ''))
+        # Last-Modified only has a resolution of seconds
+        return since is not None and mktime_tz(since) >= int(rendered)
+
+    def log_message(_self, format, *args):
+        return
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
 if __name__ == '__main__':
     # Parse the arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument("--database", required=True, help="Name of the database instance. Eg: ol_informix1410")
-    parser.add_argument("--hostname", required=True, help="IP address or hostname where the Informix instance is running")
-    parser.add_argument("--port",     required=True, help="TCP port where the Informix instance is running")
-    parser.add_argument("--user",     required=True, help="Username to connect to Informix")
-    parser.add_argument("--password", required=True, help="Password to connect to Informix")
+    parser.add_argument("--database", help="Name of the database instance. Eg: ol_informix1410")
+    parser.add_argument("--hostname", help="IP address or hostname where the Informix instance is running")
+    parser.add_argument("--port",     help="TCP port where the Informix instance is running")
+    parser.add_argument("--user",     help="Username to connect to Informix")
+    parser.add_argument("--password", help="Password to connect to Informix")
     parser.add_argument("--httpport", required=True, help="TCP port where the collector will listen on")
+    parser.add_argument("--interval", type=float, default=0, help="Refresh the metrics every N seconds in the background and serve the latest snapshot. 0 (default) queries Informix during the scrape")
+    parser.add_argument("--refresh",  action="append", default=[], metavar="NAME=SECONDS", help="Override how long the result of a sql statement is cached, eg: dbspace_sizes=600. Can be repeated, 0 runs it on every collection")
+    parser.add_argument("--pool-size", type=int, default=1, help="Number of connections to Informix. With more than 1, the queries of a collection run in parallel")
+    parser.add_argument("--no-batch", dest="batch", action="store_false", help="Run the single row statements one by one instead of in one combined statement")
+    parser.add_argument("--slow-query-log", type=float, default=0, help="Log every sql statement that takes at least this many seconds. 0 (default) disables it")
+    parser.add_argument("--max-series", type=int, default=0, help="Only report the N biggest session and lock per user series, the rest is added up in an 'other' series. 0 (default) reports all of them")
+    parser.add_argument("--queries",  help="JSON or YAML file with extra or changed sql statements and the metrics they map to")
+    parser.add_argument("--sample-rows", type=int, default=0, help="Collect per partition and per chunk I/O, reading at most this many rows per collection. 0 (default) doesn't collect them")
+    parser.add_argument("--sample-top", type=int, default=20, help="Partitions and chunks with the most I/O that get their own series")
+    parser.add_argument("--state-file", help="Where the server name, HA alias and version are kept between restarts, default /tmp/informix-collector.HOSTNAME-DATABASE.json")
+    parser.add_argument("--watch-interval", type=float, default=0, help="Run a few cheap statements every this many seconds (eg: 0.25) and export what happened between two scrapes. 0 (default) disables it")
+    parser.add_argument("--watch", action="append", metavar="NAME", help="Only watch this statement (watch_buffers, watch_ready_queue or watch_sysprofile). Can be repeated, default all of them")
+    parser.add_argument("--watch-window", type=float, default=60, help="Seconds of watched samples a scrape summarizes, default 60. Make it at least your scrape interval")
+    parser.add_argument("--watch-samples", type=int, default=1024, help="Samples kept per watched value, default 1024. To cover the whole window it needs at least watch-window / watch-interval")
+    parser.add_argument("--query-timeout", type=float, default=0, help="Seconds a single query may take before the collection carries on without it. 0 (default) waits forever")
+    parser.add_argument("--scrape-timeout", type=float, default=0, help="Seconds a whole collection may take, queries still running after that are left out. 0 (default) means no limit")
+    parser.add_argument("--breaker-threshold", type=int, default=3, help="Skip a query after it timed out this many times in a row")
+    parser.add_argument("--breaker-cooldown", type=float, default=300, help="Seconds a query that keeps timing out is skipped")
+    parser.add_argument("--cache-ttl", type=float, help="Seconds a rendered scrape result is served to every scraper before collecting again. Defaults to --interval, 0 collects on every scrape")
+    parser.add_argument("--config",   help="JSON or YAML file with Informix instances to serve on /probe?target=<name>, instead of --database/--hostname/--port/--user/--password")
+    parser.add_argument("--max-probes", type=int, default=10, help="Maximum number of probes running at the same time, others get a 503")
+    parser.add_argument("--idle-timeout", type=float, default=300, help="Close the connections of a target that hasn't been probed for this many seconds")
     args = parser.parse_args()
-    start_http_server(int(args.httpport))
-    REGISTRY.register(InformixCollector(database=args.database, hostname=args.hostname, port=args.port, user=args.user, password=args.password))
+    refresh = {}
+    for entry in args.refresh:
+        sql_name, _, seconds = entry.partition('=')
+        refresh[sql_name] = float(seconds)
+    if args.config is None:
+        for option in ['database', 'hostname', 'port', 'user', 'password']:
+            if getattr(args, option) is None:
+                parser.error("--{0} is required unless --config is used".format(option))
+        ExporterHandler.cache = ExpositionCache(REGISTRY, args.interval if args.cache_ttl is None else args.cache_ttl)
+    else:
+        ExporterHandler.manager = ProbeManager(args.config, max_probes=args.max_probes, idle_timeout=args.idle_timeout, cache_ttl=args.cache_ttl or 0, refresh=refresh, pool_size=args.pool_size, batch=args.batch, slow_query_log=args.slow_query_log, queries=args.queries, max_series=args.max_series, query_timeout=args.query_timeout, scrape_timeout=args.scrape_timeout, breaker_threshold=args.breaker_threshold, breaker_cooldown=args.breaker_cooldown, sample_rows=args.sample_rows, sample_top=args.sample_top, watch_interval=args.watch_interval, watch=args.watch, watch_samples=args.watch_samples, watch_window=args.watch_window)
+        # The exporter's own process metrics
+        ExporterHandler.cache = ExpositionCache(REGISTRY)
+    server = ThreadingHTTPServer(('', int(args.httpport)), ExporterHandler)
+    server_thread = threading.Thread(target=server.serve_forever, name='informix-http')
+    server_thread.daemon = True
+    server_thread.start()
+    if args.config is None:
+        REGISTRY.register(InformixCollector(database=args.database, hostname=args.hostname, port=args.port, user=args.user, password=args.password, interval=args.interval, refresh=refresh, pool_size=args.pool_size, batch=args.batch, slow_query_log=args.slow_query_log, queries=args.queries, max_series=args.max_series, query_timeout=args.query_timeout, scrape_timeout=args.scrape_timeout, breaker_threshold=args.breaker_threshold, breaker_cooldown=args.breaker_cooldown, sample_rows=args.sample_rows, sample_top=args.sample_top, watch_interval=args.watch_interval, watch=args.watch, watch_samples=args.watch_samples, watch_window=args.watch_window, state_file=args.state_file))
     while True:
         time.sleep(3)
 